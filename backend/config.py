@@ -68,10 +68,120 @@ def _build_cors_allowlist(landing_url: str, landing_for_referral: str) -> tuple[
 # --- API Keys ---
 OPENAI_API_KEY: str = os.environ.get("OPENAI_API_KEY", "")
 HEYGEN_API_KEY: str = os.environ.get("HEYGEN_API_KEY", "")
+# Public URL of POST /heygen/webhook, sent with each render; empty disables callbacks.
+HEYGEN_WEBHOOK_URL: str = os.environ.get("HEYGEN_WEBHOOK_URL", "")
+HEYGEN_WEBHOOK_SECRET: str = os.environ.get("HEYGEN_WEBHOOK_SECRET", "")
 
 # --- Storage ---
 DATA_DIR = Path(os.environ.get("DATA_DIR", os.path.dirname(os.path.abspath(__file__))))
 DB_PATH = DATA_DIR / "strang.db"
+# Reader connections kept open alongside the single writer (see storage.database).
+DB_READ_POOL_SIZE = int(os.environ.get("DB_READ_POOL_SIZE", "4"))
+# How long a connection waits on a locked database before raising "database is locked".
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# --- Screenplay cache ---
+# In-process LRU tier (parsed screenplays) in front of the compressed SQLite table.
+SCREENPLAY_CACHE_MEMORY_ITEMS = int(os.environ.get("SCREENPLAY_CACHE_MEMORY_ITEMS", "256"))
+# Entries not read for this long are evicted; the table is then trimmed LRU-first.
+SCREENPLAY_CACHE_TTL_DAYS = float(os.environ.get("SCREENPLAY_CACHE_TTL_DAYS", "30"))
+SCREENPLAY_CACHE_MAX_MB = float(os.environ.get("SCREENPLAY_CACHE_MAX_MB", "256"))
+SCREENPLAY_CACHE_EVICT_INTERVAL_SEC = int(
+    os.environ.get("SCREENPLAY_CACHE_EVICT_INTERVAL_SEC", "600")
+)
+# Serve a cached screenplay for a passage whose SimHash similarity (1 - hamming/64)
+# to a cached one is at least this; 0 disables near-duplicate matching.
+SCREENPLAY_NEAR_DUP_THRESHOLD = float(os.environ.get("SCREENPLAY_NEAR_DUP_THRESHOLD", "0"))
+
+# --- Render cache ---
+# Completed HeyGen renders are reused for identical payloads while their (signed,
+# expiring) video URLs are still valid. 0 disables reuse.
+RENDER_CACHE_TTL_HOURS = float(os.environ.get("RENDER_CACHE_TTL_HOURS", "144"))
+
+# --- Job queue ---
+# Async workers draining pending jobs from the jobs table (per process).
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+# Workers run inside each API process too; set 0 when `python -m worker` runs separately.
+EMBEDDED_JOB_WORKERS = int(os.environ.get("EMBEDDED_JOB_WORKERS", str(JOB_WORKERS)))
+# Visibility timeout: a job whose worker stops renewing its lease is re-claimed.
+JOB_LEASE_SEC = float(os.environ.get("JOB_LEASE_SEC", "120"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+# Fallback poll for jobs enqueued by other processes.
+JOB_POLL_INTERVAL_SEC = float(os.environ.get("JOB_POLL_INTERVAL_SEC", "2"))
+# Jobs claimed more than this long after they were queued are failed instead of run
+# (0 = never expire).
+JOB_STALE_AFTER_SEC = float(os.environ.get("JOB_STALE_AFTER_SEC", "0"))
+
+# --- Admission control (services.admission) ---
+# /generate returns 503 + Retry-After once this many jobs are queued...
+ADMISSION_MAX_QUEUE_DEPTH = int(os.environ.get("ADMISSION_MAX_QUEUE_DEPTH", "200"))
+# ...or once a new job's estimated queue wait exceeds this.
+ADMISSION_MAX_WAIT_SEC = float(os.environ.get("ADMISSION_MAX_WAIT_SEC", "600"))
+# Worker seconds per job: the mean over the last ADMISSION_SAMPLE_JOBS jobs (any
+# process), or the default until jobs have run.
+ADMISSION_DEFAULT_SERVICE_SEC = float(os.environ.get("ADMISSION_DEFAULT_SERVICE_SEC", "20"))
+ADMISSION_SAMPLE_JOBS = int(os.environ.get("ADMISSION_SAMPLE_JOBS", "50"))
+# Job workers across all processes; 0 = count the jobs being run right now.
+ADMISSION_WORKERS = int(os.environ.get("ADMISSION_WORKERS", "0"))
+ADMISSION_RETRY_AFTER_MAX_SEC = int(os.environ.get("ADMISSION_RETRY_AFTER_MAX_SEC", "300"))
+
+# --- Circuit breakers (utils.circuit_breaker) ---
+# Consecutive failed calls (transport errors / 5xx) that open a provider's breaker,
+# and how long it then fails fast before letting a probe call through.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SEC = float(os.environ.get("BREAKER_RESET_SEC", "30"))
+
+# --- Provider retries (utils.retry_policy) ---
+# Attempts per OpenAI / HeyGen call; transport errors, 429s and 5xx are retried.
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY_SEC = float(os.environ.get("RETRY_BASE_DELAY_SEC", "2"))
+# A provider asking for a longer wait (Retry-After) gets the error returned instead.
+RETRY_MAX_DELAY_SEC = float(os.environ.get("RETRY_MAX_DELAY_SEC", "30"))
+# Process-wide retry budget: each call earns RATIO retries, banked up to BURST.
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.2"))
+RETRY_BUDGET_BURST = int(os.environ.get("RETRY_BUDGET_BURST", "10"))
+# Below this many remaining requests (x-ratelimit-remaining), calls are spread
+# evenly over the rest of the provider's rate-limit window.
+RETRY_PACE_BELOW_REMAINING = int(os.environ.get("RETRY_PACE_BELOW_REMAINING", "5"))
+
+# --- Outbound HTTP (services.http_clients) ---
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.environ.get("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_KEEPALIVE_SEC = float(os.environ.get("HTTP_KEEPALIVE_SEC", "60"))
+# Used only when the h2 package is installed (httpx[http2]).
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() != "false"
+# Open a connection to each configured provider at startup.
+HTTP_PREWARM = os.environ.get("HTTP_PREWARM", "true").lower() != "false"
+
+# --- Provider status polling ---
+# Processing jobs are checked against HeyGen in the background at this interval.
+STATUS_POLL_INTERVAL_SEC = float(os.environ.get("STATUS_POLL_INTERVAL_SEC", "5"))
+STATUS_POLL_CONCURRENCY = int(os.environ.get("STATUS_POLL_CONCURRENCY", "8"))
+STATUS_POLL_BATCH_SIZE = int(os.environ.get("STATUS_POLL_BATCH_SIZE", "200"))
+# With HeyGen webhooks configured, polling is only a fallback for missed callbacks.
+STATUS_POLL_FALLBACK_INTERVAL_SEC = float(
+    os.environ.get("STATUS_POLL_FALLBACK_INTERVAL_SEC", "120")
+)
+# HeyGen status results are cached per video for TTL (± JITTER as a fraction,
+# so entries don't all expire together), then served stale for up to STALE_SEC
+# more while one background call refreshes them.
+STATUS_CACHE_TTL_SEC = float(os.environ.get("STATUS_CACHE_TTL_SEC", "10"))
+STATUS_CACHE_TTL_JITTER = float(os.environ.get("STATUS_CACHE_TTL_JITTER", "0.2"))
+STATUS_CACHE_STALE_SEC = float(os.environ.get("STATUS_CACHE_STALE_SEC", "20"))
+STATUS_CACHE_MAX_ENTRIES = int(os.environ.get("STATUS_CACHE_MAX_ENTRIES", "10000"))
+
+# --- Status streaming ---
+# Keep-alive comment interval on /generate/events streams; each one (and each
+# long-poll wait) also re-reads the job, which picks up updates made by other
+# processes (e.g. `python -m worker`).
+SSE_HEARTBEAT_SEC = float(os.environ.get("SSE_HEARTBEAT_SEC", "15"))
+# Upper bound for GET /generate/status/{job_id}?wait=N long polls.
+STATUS_LONG_POLL_MAX_SEC = float(os.environ.get("STATUS_LONG_POLL_MAX_SEC", "30"))
+
+# --- Shared state (storage.shared_state) ---
+# "sqlite" keeps rate-limit counters and the HeyGen status cache in the app
+# database, shared by every API / worker process on the box; "memory" keeps
+# them per process (cheaper, but limits multiply by the worker count).
+SHARED_STATE_BACKEND = os.environ.get("SHARED_STATE_BACKEND", "sqlite").strip().lower()
 
 # --- Rate limiting ---
 RATE_LIMIT_REQUESTS = int(os.environ.get("RATE_LIMIT_REQUESTS", "10"))
@@ -83,6 +193,20 @@ SUPABASE_JWT_SECRET: str = os.environ.get("SUPABASE_JWT_SECRET", "")
 SUPABASE_URL: str = os.environ.get("SUPABASE_URL", "").strip().rstrip("/")
 SUPABASE_ANON_KEY: str = os.environ.get("SUPABASE_ANON_KEY", "").strip()
 
+# Supabase JWKS (asymmetric JWT keys) are fetched at startup and re-fetched on
+# this interval, or sooner (but at most every MIN_SEC) when a token names an
+# unknown key.
+JWKS_REFRESH_SEC = float(os.environ.get("JWKS_REFRESH_SEC", "3600"))
+JWKS_MIN_REFRESH_SEC = float(os.environ.get("JWKS_MIN_REFRESH_SEC", "30"))
+# Verified Supabase JWTs remembered (until their exp) so repeat requests skip
+# signature verification; 0 disables the cache.
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", "10000"))
+
+# User records cached per process for profile reads (/auth/me, Stripe); the
+# /generate quota check always reads SQLite.
+USER_CACHE_TTL_SEC = float(os.environ.get("USER_CACHE_TTL_SEC", "15"))
+USER_CACHE_MAX_ENTRIES = int(os.environ.get("USER_CACHE_MAX_ENTRIES", "10000"))
+
 # --- Stripe ---
 STRIPE_SECRET_KEY: str = os.environ.get("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET: str = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
@@ -110,6 +234,12 @@ LANDING_PAGE_URL_FOR_REFERRAL: str = (
     )
 )
 
+# Count + leaderboard are served from memory and re-read this often.
+WAITLIST_SNAPSHOT_INTERVAL_SEC = int(os.environ.get("WAITLIST_SNAPSHOT_INTERVAL_SEC", "30"))
+WAITLIST_LEADERBOARD_SIZE = int(os.environ.get("WAITLIST_LEADERBOARD_SIZE", "10"))
+# Cache-Control max-age for the public waitlist count / leaderboard.
+WAITLIST_CACHE_MAX_AGE_SEC = int(os.environ.get("WAITLIST_CACHE_MAX_AGE_SEC", "30"))
+
 # --- Plan usage ---
 # Free is a one-time product trial. Paid usage resets with the Stripe period.
 FREE_TIER_VIDEO_LIMIT = int(os.environ.get("FREE_TIER_VIDEO_LIMIT", "1"))
@@ -2,62 +2,76 @@
 Strang backend — educational video generation API.
 
 Architecture:
-- FastAPI with BackgroundTasks: /generate returns immediately, work runs async.
-- SQLite persistence (aiosqlite): jobs, waitlist, users, screenplay cache.
+- FastAPI + durable job queue: /generate enqueues a row in `jobs` and returns
+  immediately; a bounded pool of async workers drains it (services.job_queue),
+  in-process and/or in separate `python -m worker` processes.
+- SQLite persistence (aiosqlite, pooled WAL connections): jobs, waitlist, users, screenplay cache.
 - Auth: Supabase JWT with legacy API-key fallback.
 - Payments: Stripe Checkout + webhook for subscription lifecycle.
-- Retry on transient failures (tenacity) for OpenAI (screenplay) & HeyGen (video) calls.
+- Budgeted, rate-limit-aware retries (utils.retry_policy) and circuit breakers
+  for OpenAI (screenplay) & HeyGen (video) calls.
 - Structured logging throughout.
 """
 
-import hashlib
+import asyncio
 import logging
-import sys
-import time
 import uuid
 
 from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
 
-from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Request
+from fastapi import BackgroundTasks, Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, RedirectResponse, Response
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
 
 import config
 from models.schemas import (
     GenerateRequest,
     GenerateResponse,
-    Screenplay,
     StatusResponse,
     WaitlistCountResponse,
+    WaitlistLeaderboardResponse,
     WaitlistPositionResponse,
     WaitlistRequest,
     WaitlistResponse,
 )
-from services.heygen_service import heygen_create_video, heygen_get_status
-from services.openai_director import get_screenplay
+from services.admission import admission
+from services.heygen_service import parse_webhook_event
+from services.http_clients import clients as http_clients
+from services.job_queue import JobQueue
+from services.jwks import jwks
+from services.screenplay_cache import screenplay_cache
+from services.status_poller import poller as status_poller, record_provider_status
 from services.stripe_service import (
     create_checkout_session,
     create_portal_session,
     handle_webhook_event,
 )
+from services.video_pipeline import run_queued_job
+from services.waitlist_snapshot import snapshot as waitlist_snapshot
 from storage.database import (
     add_email,
-    cache_screenplay,
+    close_pool,
     create_job,
     create_user,
-    get_cached_screenplay,
     get_job,
     get_user,
     get_waitlist_count,
     get_waitlist_entry,
     get_waitlist_position,
-    increment_videos_generated,
     init_db,
+    job_updates,
+    list_processing_jobs_for_video,
     list_user_jobs,
-    update_job,
+    open_pool,
 )
+from storage.shared_state import rate_limit_backend
 from utils.auth import require_auth
-from utils.rate_limit import rate_limit_check
+from utils.circuit_breaker import breaker_states
+from utils.http_cache import cached_json
+from utils.logs import setup_logging
+from utils.rate_limit import rate_limit_check, use_backend as use_rate_limit_backend
+from utils.retry_policy import retry_stats
 
 logger = logging.getLogger("strang")
 
@@ -71,8 +85,6 @@ async def _notify_discord_waitlist(email: str, position: int, total: int, is_new
     if not config.DISCORD_WEBHOOK_URL:
         return
     try:
-        import httpx
-
         action = "New Signup" if is_new else "Re-joined"
         payload = {
             "embeds": [
@@ -88,69 +100,20 @@ async def _notify_discord_waitlist(email: str, position: int, total: int, is_new
                 }
             ]
         }
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.post(config.DISCORD_WEBHOOK_URL, json=payload)
+        await http_clients.get("discord").post(config.DISCORD_WEBHOOK_URL, json=payload, timeout=5.0)
     except Exception as exc:
         logger.warning("Discord notification failed: %s", exc)
 
 
-# ---------------------------------------------------------------------------
-# Provider status cache — avoids hammering HeyGen on every client poll
-# TTL of 10 seconds is safe: short enough to feel responsive, long enough to
-# collapse burst polls from a single job into one external request.
-# ---------------------------------------------------------------------------
-_status_cache: dict[str, tuple[float, dict]] = {}
-_STATUS_CACHE_TTL = 10  # seconds
-
-# HeyGen jobs that stay in "processing" beyond this threshold are force-failed.
-_HEYGEN_TIMEOUT_MINUTES = 15
-
-
-async def _get_cached_heygen_status(video_id: str) -> dict:
-    """Return cached HeyGen status if fresh, otherwise fetch and cache it."""
-    now = time.monotonic()
-    cached = _status_cache.get(video_id)
-    if cached:
-        ts, result = cached
-        if now - ts < _STATUS_CACHE_TTL:
-            return result
-
-    result = await heygen_get_status(video_id)
-    _status_cache[video_id] = (now, result)
-    return result
-
-
-def _evict_status_cache(video_id: str) -> None:
-    """Remove a video from the status cache once its job reaches a terminal state."""
-    _status_cache.pop(video_id, None)
-
-
-# ---------------------------------------------------------------------------
-# Logging setup
-# ---------------------------------------------------------------------------
-
-def _setup_logging() -> None:
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(
-        logging.Formatter(
-            "%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-    )
-    root = logging.getLogger("strang")
-    root.setLevel(logging.INFO)
-    root.addHandler(handler)
-
-
 # ---------------------------------------------------------------------------
 # Subscription check helper
 # ---------------------------------------------------------------------------
 
-async def _ensure_user_record(user: dict) -> dict:
-    """Ensure a user row exists in SQLite. Returns the DB record."""
+async def _ensure_user_record(user: dict, fresh: bool = False) -> dict:
+    """Ensure a user row exists in SQLite. Returns the DB record (*fresh*: not a cached copy)."""
     if user["role"] == "admin":
         return {**user, "subscription_status": "active", "plan": "pro", "videos_generated": 0, "videos_limit": 999999}
-    record = await get_user(user["user_id"])
+    record = await get_user(user["user_id"], fresh=fresh)
     if not record:
         record = await create_user(user["user_id"], user.get("email", ""))
     return record
@@ -158,7 +121,8 @@ async def _ensure_user_record(user: dict) -> dict:
 
 async def require_subscription(request: Request, user: dict = Depends(require_auth)) -> dict:
     """Gate video generation behind subscription / free-tier limit."""
-    record = await _ensure_user_record(user)
+    # Usage may have been counted by another process since the record was cached.
+    record = await _ensure_user_record(user, fresh=True)
     if record["videos_generated"] >= record["videos_limit"]:
         is_paid = record.get("subscription_status") in ("active", "trialing")
         raise HTTPException(
@@ -177,56 +141,10 @@ async def require_subscription(request: Request, user: dict = Depends(require_au
 
 
 # ---------------------------------------------------------------------------
-# Background worker
+# Job queue — set EMBEDDED_JOB_WORKERS=0 when `python -m worker` runs separately
 # ---------------------------------------------------------------------------
 
-async def process_video_job(
-    job_id: str,
-    text: str,
-    user_id: str | None = None,
-    mode: str = "study",
-    goal: str = "understand",
-    depth: str = "standard",
-) -> None:
-    """Background task: OpenAI screenplay -> HeyGen video creation."""
-    try:
-        cache_input = f"{mode}:{goal}:{depth}:{text}"
-        text_hash = hashlib.sha256(cache_input.encode()).hexdigest()
-        cached = await get_cached_screenplay(text_hash)
-
-        if cached:
-            screenplay = Screenplay.model_validate(cached)
-            logger.info("Cache hit for job %s", job_id)
-        else:
-            screenplay = await get_screenplay(text, mode=mode, goal=goal, depth=depth)
-            await cache_screenplay(text_hash, screenplay.model_dump_json())
-            logger.info("Screenplay generated for job %s", job_id)
-
-        video_id = await heygen_create_video(screenplay)
-        await update_job(
-            job_id,
-            video_id=video_id,
-            status="processing",
-            project_title=screenplay.project_title,
-            key_takeaway=screenplay.key_takeaway,
-            comprehension_question=screenplay.comprehension_question,
-            comprehension_answer=screenplay.comprehension_answer,
-        )
-        logger.info(
-            "HeyGen video queued for job %s (video_id=%s)",
-            job_id,
-            video_id,
-        )
-
-        if user_id and user_id not in ("admin", "anonymous"):
-            await increment_videos_generated(user_id)
-
-    except HTTPException as exc:
-        logger.error("Job %s failed: %s", job_id, exc.detail)
-        await update_job(job_id, status="failed", error=exc.detail)
-    except Exception as exc:
-        logger.error("Job %s failed unexpectedly: %s", job_id, exc, exc_info=True)
-        await update_job(job_id, status="failed", error=str(exc))
+job_queue = JobQueue(run_queued_job, config.EMBEDDED_JOB_WORKERS)
 
 
 # ---------------------------------------------------------------------------
@@ -235,8 +153,23 @@ async def process_video_job(
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
-    _setup_logging()
+    setup_logging()
     await init_db()
+    await open_pool()
+    use_rate_limit_backend(rate_limit_backend())
+    await http_clients.open()
+    if config.SUPABASE_URL:
+        await jwks.refresh()
+    await screenplay_cache.refresh_index()
+    await waitlist_snapshot.refresh()
+    await job_queue.start()
+    background = [
+        asyncio.create_task(waitlist_snapshot.run()),
+        asyncio.create_task(screenplay_cache.run()),
+        asyncio.create_task(status_poller.run()),
+    ]
+    if config.SUPABASE_URL:
+        background.append(asyncio.create_task(jwks.run()))
     logger.info(
         "Strang API started (CORS raw=%r, %d origin(s))",
         config.CORS_ORIGINS_RAW,
@@ -244,6 +177,13 @@ async def lifespan(_app: FastAPI):
     )
     yield
     logger.info("Strang API shutting down")
+    await job_queue.stop()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await screenplay_cache.flush_hits()
+    await http_clients.close()
+    await close_pool()
 
 
 app = FastAPI(title="Strang API", version="2.0.0", lifespan=lifespan)
@@ -345,18 +285,16 @@ async def refresh_token(request: Request):
     if not rt:
         raise HTTPException(status_code=400, detail="refresh_token is required.")
 
-    import httpx
-
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            res = await client.post(
-                f"{config.SUPABASE_URL}/auth/v1/token?grant_type=refresh_token",
-                headers={
-                    "apikey": config.SUPABASE_ANON_KEY,
-                    "Content-Type": "application/json",
-                },
-                json={"refresh_token": rt},
-            )
+        res = await http_clients.get("supabase").post(
+            f"{config.SUPABASE_URL}/auth/v1/token?grant_type=refresh_token",
+            headers={
+                "apikey": config.SUPABASE_ANON_KEY,
+                "Content-Type": "application/json",
+            },
+            json={"refresh_token": rt},
+            timeout=10.0,
+        )
     except Exception as exc:
         logger.warning("Token refresh network error: %s", exc)
         raise HTTPException(status_code=502, detail="Could not reach auth server.")
@@ -398,6 +336,23 @@ async def stripe_webhook(request: Request):
     return {"ok": True}
 
 
+# ---------------------------------------------------------------------------
+# HeyGen webhook — completion callbacks; the status poller is the fallback
+# ---------------------------------------------------------------------------
+
+@app.post("/heygen/webhook")
+async def heygen_webhook(request: Request):
+    """Record a HeyGen render completion/failure (no auth — HeyGen signs the payload)."""
+    event = parse_webhook_event(await request.body(), request.headers.get("signature", ""))
+    # Jobs that shared one render all wait on its video id (callback_id names only one).
+    jobs = await list_processing_jobs_for_video(event["video_id"]) if event["video_id"] else []
+    if not jobs:
+        logger.info("HeyGen webhook for video %s matched no processing job", event["video_id"])
+    for job in jobs:
+        await record_provider_status(job, event)
+    return {"ok": True}
+
+
 # ---------------------------------------------------------------------------
 # Video generation routes
 # ---------------------------------------------------------------------------
@@ -406,12 +361,12 @@ async def stripe_webhook(request: Request):
 async def generate(
     request: Request,
     req: GenerateRequest,
-    bg: BackgroundTasks,
     user: dict = Depends(require_subscription),
 ):
-    """Accept text, queue a background job, and return immediately."""
+    """Accept text, enqueue a durable job, and return immediately."""
     client_id = request.client.host if request.client else "unknown"
-    rate_limit_check(client_id)
+    await rate_limit_check(client_id, user.get("user_id"))
+    await admission.check()
 
     text = req.text.strip()
     job_id = str(uuid.uuid4())
@@ -425,15 +380,7 @@ async def generate(
         depth=req.depth,
     )
 
-    bg.add_task(
-        process_video_job,
-        job_id,
-        text,
-        user.get("user_id"),
-        req.mode,
-        req.goal,
-        req.depth,
-    )
+    job_queue.notify()
     logger.info(
         "Job %s queued for user %s (HeyGen)",
         job_id,
@@ -443,13 +390,8 @@ async def generate(
     return GenerateResponse(job_id=job_id)
 
 
-@app.get("/generate/status/{job_id}", response_model=StatusResponse)
-async def get_status(job_id: str, _user: dict = Depends(require_auth)):
-    """Poll job status. Fetches provider status for in-progress jobs."""
-    job = await get_job(job_id)
-    if not job:
-        raise HTTPException(status_code=404, detail="Job not found")
-
+def _status_response(job: dict, expose_processing: bool = False) -> StatusResponse:
+    """Client view of a job row. ``processing`` reads as ``pending`` unless exposed."""
     status = job["status"]
     learning = {
         "title": job.get("project_title"),
@@ -465,69 +407,89 @@ async def get_status(job_id: str, _user: dict = Depends(require_auth)):
         return StatusResponse(status="completed", video_url=job.get("video_url"), **learning)
     if status == "failed":
         return StatusResponse(status="failed", error=job.get("error"), **learning)
+    if status == "processing" and expose_processing:
+        return StatusResponse(status="processing", **learning)
+    return StatusResponse(status="pending", **learning)
 
-    video_id = job.get("video_id")
-    engine = (job.get("engine") or "heygen").lower()
 
-    if video_id and status == "processing":
-        if engine == "openai":
-            legacy = (
-                "This job used the legacy OpenAI video engine, which is no longer available. "
-                "Please generate again — videos are now rendered with HeyGen only."
-            )
-            await update_job(job_id, status="failed", error=legacy)
-            _evict_status_cache(video_id)
-            return StatusResponse(status="failed", error=legacy)
-
-        # ---------------------------------------------------------------
-        # HeyGen timeout guard: fail jobs that have been processing too long
-        # to prevent them hanging indefinitely if HeyGen never responds.
-        # ---------------------------------------------------------------
-        created_at = job.get("created_at")
-        if created_at:
+@app.get("/generate/status/{job_id}", response_model=StatusResponse)
+async def get_status(
+    job_id: str,
+    wait: float = Query(0, ge=0),
+    _user: dict = Depends(require_auth),
+):
+    """Poll job status. A pure DB read; services.status_poller advances processing jobs.
+
+    With ``?wait=N`` (long poll, capped at STATUS_LONG_POLL_MAX_SEC) the request is
+    held until the response would change or N seconds pass, then returns as usual.
+    """
+    with job_updates.subscribe(job_id) as changed:
+        job = await get_job(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        current = _status_response(job)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(wait, config.STATUS_LONG_POLL_MAX_SEC)
+        while current.status not in ("completed", "failed"):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
             try:
-                job_age_minutes = (time.time() - float(created_at)) / 60
-                if job_age_minutes > _HEYGEN_TIMEOUT_MINUTES:
-                    error = f"HeyGen job timed out after {_HEYGEN_TIMEOUT_MINUTES} minutes"
-                    logger.warning("Job %s timed out: %s", job_id, error)
-                    await update_job(job_id, status="failed", error=error)
-                    _evict_status_cache(video_id)
-                    return StatusResponse(status="failed", error=error)
-            except (TypeError, ValueError):
+                async with asyncio.timeout(min(remaining, config.SSE_HEARTBEAT_SEC)):
+                    await changed.wait()
+            except TimeoutError:
                 pass
+            changed.clear()
+            job = await get_job(job_id) or job
+            latest = _status_response(job)
+            if latest != current:
+                return latest
+    return current
 
-        provider_failed = ("failed", "error")
-        provider_error_default = "HeyGen reported failure"
-
-        try:
-            result = await _get_cached_heygen_status(video_id)
-            provider_status = result.get("status", "pending")
-        except Exception as exc:
-            error = f"HeyGen status check failed: {exc}"
-            logger.error("Job %s polling failed: %s", job_id, error)
-            await update_job(job_id, status="failed", error=error)
-            _evict_status_cache(video_id)
-            return StatusResponse(status="failed", error=error)
-
-        if provider_status == "completed":
-            url = result.get("video_url")
-            if not url:
-                error = "HeyGen completed the job but no video URL was returned."
-                await update_job(job_id, status="failed", error=error)
-                _evict_status_cache(video_id)
-                return StatusResponse(status="failed", error=error)
-
-            await update_job(job_id, status="completed", video_url=url)
-            _evict_status_cache(video_id)
-            return StatusResponse(status="completed", video_url=url, **learning)
-
-        if provider_status in provider_failed:
-            error = result.get("error", provider_error_default)
-            await update_job(job_id, status="failed", error=error)
-            _evict_status_cache(video_id)
-            return StatusResponse(status="failed", error=error)
 
-    return StatusResponse(status="pending", **learning)
+async def _job_event_stream(
+    job_id: str,
+    last_event_id: str | None,
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[str]:
+    """Yield an SSE ``status`` event per job change until the job is finished.
+
+    The event id is the row's ``updated_at``; a client reconnecting with
+    ``Last-Event-ID`` only gets the current state if it changed since.
+    """
+    sent = last_event_id
+    with job_updates.subscribe(job_id) as changed:
+        while True:
+            job = await get_job(job_id)
+            if job is None:
+                return
+            event_id = f"{job['updated_at']:.6f}"
+            if event_id != sent:
+                sent = event_id
+                data = _status_response(job, expose_processing=True).model_dump_json()
+                yield f"id: {event_id}\nevent: status\ndata: {data}\n\n"
+            if job["status"] in ("completed", "failed"):
+                return
+            try:
+                async with asyncio.timeout(config.SSE_HEARTBEAT_SEC):
+                    await changed.wait()
+            except TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": keep-alive\n\n"
+            changed.clear()
+
+
+@app.get("/generate/events/{job_id}")
+async def job_events(job_id: str, request: Request, _user: dict = Depends(require_auth)):
+    """Server-Sent Events stream of job status; replaces polling /generate/status."""
+    if not await get_job(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _job_event_stream(job_id, request.headers.get("last-event-id"), request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/library")
@@ -573,6 +535,7 @@ async def waitlist_help():
         "service": "Strang API",
         "waitlist_join": "POST JSON { email, ref? } to this same path",
         "waitlist_count": "GET /waitlist/count",
+        "waitlist_leaderboard": "GET /waitlist/leaderboard",
         "health": "GET /health",
     }
 
@@ -582,7 +545,8 @@ async def waitlist_join(req: WaitlistRequest, bg: BackgroundTasks):
     """Add email to waitlist. Idempotent. Supports referral tracking."""
     result = await add_email(req.email, referred_by_code=req.ref)
 
-    total = await get_waitlist_count()
+    total = result["total"]
+    waitlist_snapshot.note_signup(total)
     base = config.LANDING_PAGE_URL_FOR_REFERRAL.rstrip("/")
     referral_link = f"{base}/?ref={result['referral_code']}" if result["referral_code"] else base
 
@@ -628,10 +592,31 @@ async def waitlist_join(req: WaitlistRequest, bg: BackgroundTasks):
 
 
 @app.get("/waitlist/count", response_model=WaitlistCountResponse)
-async def waitlist_count():
-    """Return number of waitlist signups."""
-    count = await get_waitlist_count()
-    return WaitlistCountResponse(count=count)
+async def waitlist_count(request: Request):
+    """Return number of waitlist signups (in-memory snapshot, ETag-cacheable)."""
+    if waitlist_snapshot.count is None:
+        await waitlist_snapshot.refresh()
+    return cached_json(
+        request,
+        WaitlistCountResponse(count=waitlist_snapshot.count).model_dump(),
+        config.WAITLIST_CACHE_MAX_AGE_SEC,
+    )
+
+
+@app.get("/waitlist/leaderboard", response_model=WaitlistLeaderboardResponse)
+async def waitlist_leaderboard(request: Request):
+    """Return the top referrers (masked emails), refreshed periodically in the background."""
+    if waitlist_snapshot.count is None:
+        await waitlist_snapshot.refresh()
+    return cached_json(
+        request,
+        WaitlistLeaderboardResponse(
+            entries=waitlist_snapshot.leaderboard,
+            total=waitlist_snapshot.count,
+            updated_at=waitlist_snapshot.updated_at,
+        ).model_dump(),
+        config.WAITLIST_CACHE_MAX_AGE_SEC,
+    )
 
 
 @app.get("/waitlist/position", response_model=WaitlistPositionResponse)
@@ -655,7 +640,7 @@ async def waitlist_position(email: str):
 # ---------------------------------------------------------------------------
 
 @app.get("/health")
-def health():
+async def health():
     """Basic health check; reports which integrations are configured."""
     return {
         "status": "ok",
@@ -663,6 +648,16 @@ def health():
         "heygen_configured": bool(config.HEYGEN_API_KEY.strip()),
         "auth_configured": bool(config.SUPABASE_JWT_SECRET),
         "stripe_configured": bool(config.STRIPE_SECRET_KEY),
+        "screenplay_cache": screenplay_cache.stats(),
+        "queue": {
+            "depth": await job_queue.depth(),
+            "workers": job_queue.workers,
+            "active": job_queue.active,
+        },
+        "admission": await admission.stats(),
+        "circuit_breakers": breaker_states(),
+        "provider_retries": retry_stats(),
+        "status_poller": status_poller.stats(),
     }
 
 
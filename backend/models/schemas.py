@@ -80,3 +80,15 @@ class WaitlistPositionResponse(BaseModel):
     referral_code: str
     referral_count: int
     total: int
+
+
+class LeaderboardEntry(BaseModel):
+    position: int
+    email: str  # masked, e.g. "ja***@example.com"
+    referral_count: int
+
+
+class WaitlistLeaderboardResponse(BaseModel):
+    entries: list[LeaderboardEntry]
+    total: int
+    updated_at: float
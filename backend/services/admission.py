@@ -0,0 +1,66 @@
+"""Admission control for /generate: shed load before a job row is created.
+
+The estimated wait for a new job is the queue depth times the recent worker
+time per job divided by the worker count. Both come from the jobs table, so
+every API process agrees, whether or not it runs workers itself: the time is
+the mean claim-to-render-start of the last ``ADMISSION_SAMPLE_JOBS`` jobs, and
+the worker count is ``ADMISSION_WORKERS`` or, when that is 0, the number of
+jobs under lease right now (under load, every worker holds one). When the
+queue is at ``ADMISSION_MAX_QUEUE_DEPTH`` or the estimate exceeds
+``ADMISSION_MAX_WAIT_SEC``, the request is rejected with 503 and a
+``Retry-After`` for when the excess should have drained.
+"""
+
+import math
+
+from fastapi import HTTPException
+
+import config
+from storage.database import queue_load, recent_service_time
+
+
+class AdmissionController:
+    def __init__(self) -> None:
+        self.rejected = 0
+
+    async def load(self) -> tuple[int, float, int]:
+        """(queue depth, seconds per job, workers) as seen by every process."""
+        depth, leased = await queue_load()
+        service = await recent_service_time(config.ADMISSION_SAMPLE_JOBS)
+        if service is None:
+            service = config.ADMISSION_DEFAULT_SERVICE_SEC
+        workers = config.ADMISSION_WORKERS if config.ADMISSION_WORKERS > 0 else leased
+        return depth, max(0.0, service), max(1, workers)
+
+    @staticmethod
+    def retry_after(depth: int, service_time: float, workers: int) -> int:
+        """Seconds until the queue is back under both limits; 0 means admit now."""
+        per_slot = service_time / max(1, workers)
+        excess = depth * per_slot - config.ADMISSION_MAX_WAIT_SEC
+        if depth >= config.ADMISSION_MAX_QUEUE_DEPTH:
+            excess = max(excess, (depth - config.ADMISSION_MAX_QUEUE_DEPTH + 1) * per_slot, 1)
+        if excess <= 0:
+            return 0
+        return min(max(1, math.ceil(excess)), config.ADMISSION_RETRY_AFTER_MAX_SEC)
+
+    async def check(self) -> None:
+        """Raise 503 with Retry-After if a new job should not be queued right now."""
+        retry_after = self.retry_after(*await self.load())
+        if retry_after:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Strang is busy right now. Please try again shortly.",
+                headers={"Retry-After": str(retry_after)},
+            )
+
+    async def stats(self) -> dict:
+        _, service_time, workers = await self.load()
+        return {
+            "service_time_sec": round(service_time, 2),
+            "workers": workers,
+            "rejected": self.rejected,
+        }
+
+
+admission = AdmissionController()
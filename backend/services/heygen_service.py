@@ -1,18 +1,18 @@
-"""HeyGen Video Agent integration: screenplay → video creation and status polling."""
+"""HeyGen Video Agent integration: screenplay → video creation, status polling, webhooks."""
 
+import hashlib
+import hmac
+import json
 import logging
 
 import httpx
 from fastapi import HTTPException
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
 
 import config
 from models.schemas import Screenplay
+from services.http_clients import clients as http_clients, is_server_error
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.retry_policy import RETRYABLE_STATUS, send
 
 logger = logging.getLogger("strang.heygen")
 
@@ -44,39 +44,63 @@ def build_video_agent_prompt(screenplay: Screenplay) -> str:
     return "\n".join(instructions + scenes)
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((httpx.TransportError, httpx.TimeoutException)),
-    reraise=True,
-)
+def build_video_agent_payload(screenplay: Screenplay) -> dict:
+    """Build the Video Agent request body for *screenplay*."""
+    return {
+        "prompt": build_video_agent_prompt(screenplay),
+        "config": {
+            "orientation": "landscape",
+            "resolution": "1080p",   # explicit resolution for consistent output quality
+            "avatar": False,         # explicitly disable talking head / avatar
+            "caption": False,        # disable auto-generated subtitles
+        },
+    }
+
+
+def render_cache_key(screenplay: Screenplay) -> str:
+    """Hash of the request payload: identical payloads render identical videos.
+
+    Per-job callback fields are added in ``heygen_create_video`` and not hashed.
+    """
+    payload = build_video_agent_payload(screenplay)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
 async def _call_heygen_create(payload: dict) -> httpx.Response:
-    """HTTP call to HeyGen create with automatic retry on transport failures."""
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        return await client.post(
+    """HTTP call to HeyGen create, retried on transport errors, 429s and 5xx."""
+    breaker = get_breaker("heygen")
+    return await send("heygen", lambda: breaker.call(
+        lambda: http_clients.get("heygen").post(
             HEYGEN_VIDEO_AGENT_URL,
             headers={"X-Api-Key": config.HEYGEN_API_KEY, "Content-Type": "application/json"},
             json=payload,
-        )
+            timeout=60.0,
+        ),
+        is_failure=is_server_error,
+    ))
 
 
-async def heygen_create_video(screenplay: Screenplay) -> str:
-    """Call HeyGen Video Agent. Returns video_id."""
+async def heygen_create_video(screenplay: Screenplay, callback_id: str | None = None) -> str:
+    """Call HeyGen Video Agent. Returns video_id.
+
+    With ``HEYGEN_WEBHOOK_URL`` set, HeyGen reports completion to /heygen/webhook
+    and echoes *callback_id* (the job id) back in the event.
+    """
     if not config.HEYGEN_API_KEY:
         raise HTTPException(status_code=500, detail="HEYGEN_API_KEY is not set.")
 
-    prompt = build_video_agent_prompt(screenplay)
-    payload = {
-        "prompt": prompt,
-        "config": {
-            "orientation": "landscape",
-            "resolution": "1080p",   # explicit resolution for consistent output quality
-            "avatar": False,         # explicitly disable talking head / avatar
-            "caption": False,        # disable auto-generated subtitles
-        },
-    }
-
-    r = await _call_heygen_create(payload)
+    payload = build_video_agent_payload(screenplay)
+    if callback_id:
+        payload["callback_id"] = callback_id
+        if config.HEYGEN_WEBHOOK_URL:
+            payload["callback_url"] = config.HEYGEN_WEBHOOK_URL
+    try:
+        r = await _call_heygen_create(payload)
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=503,
+            detail="HeyGen is temporarily unavailable. Please try again in a few minutes.",
+        )
 
     if r.status_code != 200:
         err = r.text
@@ -101,13 +125,24 @@ async def heygen_create_video(screenplay: Screenplay) -> str:
 
 
 async def heygen_get_status(video_id: str) -> dict:
-    """Poll HeyGen video status. Returns dict with status and optional video_url."""
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        r = await client.get(
+    """Poll HeyGen video status. Returns dict with status and optional video_url.
+
+    Raises ``CircuitOpenError`` while the HeyGen breaker is open. A 429 / 5xx
+    comes back as status ``unavailable``: the job is simply checked again on
+    the next poll, so the call is paced but not retried here.
+    """
+    breaker = get_breaker("heygen")
+    r = await send("heygen", lambda: breaker.call(
+        lambda: http_clients.get("heygen").get(
             HEYGEN_STATUS_URL,
             headers={"X-Api-Key": config.HEYGEN_API_KEY},
             params={"video_id": video_id},
-        )
+            timeout=15.0,
+        ),
+        is_failure=is_server_error,
+    ), attempts=1)
+    if r.status_code in RETRYABLE_STATUS:
+        return {"status": "unavailable", "error": r.text}
     if r.status_code != 200:
         return {"status": "error", "error": r.text}
 
@@ -115,4 +150,40 @@ async def heygen_get_status(video_id: str) -> dict:
     inner = data.get("data", data)
     status = (inner.get("status") or "").lower()
     url = inner.get("video_url") or inner.get("url") or inner.get("result_url")
-    return {"status": status, "video_url": url, "raw": data}
\ No newline at end of file
+    return {"status": status, "video_url": url, "raw": data}
+
+
+def webhook_signature(payload: bytes, secret: str) -> str:
+    """Hex HMAC-SHA256 of the raw body, as sent in HeyGen's ``signature`` header."""
+    return hmac.new(secret.encode(), payload, hashlib.sha256).hexdigest()
+
+
+def parse_webhook_event(payload: bytes, signature: str) -> dict:
+    """Verify a HeyGen webhook and normalize it to the shape of ``heygen_get_status``.
+
+    Returns ``status`` (``completed`` / ``failed``, or the raw event type for events
+    we do not act on) plus ``video_id``, ``callback_id``, ``video_url`` and ``error``.
+    """
+    if not config.HEYGEN_WEBHOOK_SECRET:
+        raise HTTPException(status_code=501, detail="HeyGen webhooks are not configured.")
+    expected = webhook_signature(payload, config.HEYGEN_WEBHOOK_SECRET)
+    if not hmac.compare_digest(expected, signature or ""):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature.")
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid webhook payload.")
+
+    event_type = event.get("event_type", "")
+    data = event.get("event_data") or {}
+    status = {
+        "avatar_video.success": "completed",
+        "avatar_video.fail": "failed",
+    }.get(event_type, event_type)
+    return {
+        "status": status,
+        "video_id": data.get("video_id"),
+        "callback_id": data.get("callback_id"),
+        "video_url": data.get("url") or data.get("video_url"),
+        "error": data.get("msg") or data.get("error") or "HeyGen reported failure",
+    }
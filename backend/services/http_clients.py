@@ -0,0 +1,124 @@
+"""Shared outbound HTTP clients, one per provider.
+
+Opened in ``main.lifespan`` (and ``worker.run``) so calls to OpenAI, HeyGen,
+Supabase and Discord reuse pooled keep-alive connections instead of paying a
+TCP + TLS handshake per request. HTTP/2 is used when the ``h2`` package is
+installed (``httpx[http2]``). Outside the app lifecycle (scripts, unit tests)
+``get`` lazily creates a client for the running event loop.
+"""
+
+import asyncio
+import importlib.util
+import logging
+from typing import Iterable
+
+import httpx
+
+import config
+
+logger = logging.getLogger("strang.http")
+
+
+def _providers() -> dict[str, tuple[str, bool]]:
+    """Provider name -> (base URL, configured?). Unconfigured providers are not pre-warmed."""
+    return {
+        "openai": ("https://api.openai.com", bool(config.OPENAI_API_KEY)),
+        "heygen": ("https://api.heygen.com", bool(config.HEYGEN_API_KEY)),
+        "supabase": (config.SUPABASE_URL, bool(config.SUPABASE_URL)),
+        "discord": ("https://discord.com", bool(config.DISCORD_WEBHOOK_URL)),
+    }
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+_ssl_context = None
+
+
+def _new_client() -> httpx.AsyncClient:
+    global _ssl_context
+    if _ssl_context is None:
+        # Loading the CA bundle is the slow part of building a client; do it once.
+        _ssl_context = httpx.create_ssl_context()
+    return httpx.AsyncClient(
+        verify=_ssl_context,
+        http2=config.HTTP2_ENABLED and _http2_available(),
+        limits=httpx.Limits(
+            max_connections=config.HTTP_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=config.HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_expiry=config.HTTP_KEEPALIVE_SEC,
+        ),
+        timeout=30.0,
+    )
+
+
+def is_server_error(response: httpx.Response) -> bool:
+    """5xx: the provider itself is failing (counts against its circuit breaker)."""
+    return response.status_code >= 500
+
+
+async def _close_all(clients: Iterable[httpx.AsyncClient]) -> None:
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as exc:
+            logger.warning("Closing HTTP client failed: %s", exc)
+
+
+class HttpClients:
+    def __init__(self) -> None:
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._warmup: asyncio.Task | None = None
+        self._retiring: set[asyncio.Task] = set()
+
+    async def open(self) -> None:
+        """Create every provider client and pre-warm configured ones in the background."""
+        await self.close()
+        self._loop = asyncio.get_running_loop()
+        self._clients = {name: _new_client() for name in _providers()}
+        if config.HTTP_PREWARM:
+            self._warmup = asyncio.create_task(self._prewarm())
+
+    async def close(self) -> None:
+        if self._warmup is not None:
+            self._warmup.cancel()
+            await asyncio.gather(self._warmup, return_exceptions=True)
+            self._warmup = None
+        clients, self._clients = self._clients, {}
+        await _close_all(clients.values())
+
+    def get(self, provider: str) -> httpx.AsyncClient:
+        """Return the shared client for *provider* (one per host, so limits are per host)."""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Not opened on this loop (script / test): connections can't cross loops.
+            # Close the previous loop's clients rather than dropping their pools.
+            self._loop = loop
+            stale, self._clients = self._clients, {}
+            if stale:
+                task = loop.create_task(_close_all(stale.values()))
+                self._retiring.add(task)
+                task.add_done_callback(self._retiring.discard)
+        client = self._clients.get(provider)
+        if client is None:
+            client = self._clients[provider] = _new_client()
+        return client
+
+    async def _prewarm(self) -> None:
+        """Open one connection per configured provider so the first real call skips the handshake."""
+        async def _warm(name: str, base_url: str) -> None:
+            try:
+                await self._clients[name].head(base_url, timeout=5.0)
+            except Exception as exc:
+                logger.info("Pre-warming %s failed: %s", name, exc)
+
+        await asyncio.gather(*(
+            _warm(name, base_url)
+            for name, (base_url, configured) in _providers().items()
+            if configured
+        ))
+
+
+clients = HttpClients()
@@ -0,0 +1,142 @@
+"""Durable job queue: pending rows in ``jobs`` drained by a bounded worker pool.
+
+Jobs survive restarts because the queue *is* the jobs table. A worker claims a
+job by taking a lease (``lease_owner`` / ``lease_expires_at``) and renews it
+while the job runs; if the process dies the lease lapses and another worker
+re-claims the job. Throughput is set by ``JOB_WORKERS``, not by request volume.
+
+With ``JOB_STALE_AFTER_SEC`` set, a job claimed after that long in the queue
+is failed instead of run. The check happens on claim, so each job is judged
+once, by the worker holding its lease, however many processes start.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable
+
+import config
+from storage.database import (
+    claim_job,
+    count_queued_jobs,
+    release_job_lease,
+    renew_job_lease,
+    update_job,
+)
+
+logger = logging.getLogger("strang.queue")
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+
+class JobQueue:
+    def __init__(self, handler: JobHandler, workers: int) -> None:
+        self._handler = handler
+        self.workers = max(0, workers)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.active = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    def notify(self) -> None:
+        """Wake idle workers after a job was enqueued in this process."""
+        self._wakeup.set()
+
+    async def recover(self) -> int:
+        """Count pending jobs left by earlier runs; they are re-claimed as leases lapse."""
+        pending = await count_queued_jobs()
+        if pending:
+            logger.info("Resuming %d pending job(s)", pending)
+        return pending
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        await self.recover()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self._tasks:
+            self.notify()
+
+    async def stop(self) -> None:
+        """Cancel workers; their leases are released so jobs resume elsewhere at once."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def depth(self) -> int:
+        return await count_queued_jobs()
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await claim_job(self.owner, config.JOB_LEASE_SEC)
+            except Exception as exc:
+                logger.warning("Job claim failed: %s", exc)
+                job = None
+            if job is None:
+                # Not wait_for: on 3.11 it can swallow a cancel that races the wakeup,
+                # leaving stop() waiting on a worker that never exits.
+                try:
+                    async with asyncio.timeout(config.JOB_POLL_INTERVAL_SEC):
+                        await self._wakeup.wait()
+                except TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict) -> None:
+        job_id = job["id"]
+        if job["attempts"] > config.JOB_MAX_ATTEMPTS:
+            logger.error("Job %s abandoned after %d attempts", job_id, job["attempts"] - 1)
+            await update_job(
+                job_id,
+                status="failed",
+                error="Video generation was interrupted too many times. Please generate again.",
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+            return
+        age = time.time() - job["created_at"]
+        if 0 < config.JOB_STALE_AFTER_SEC < age:
+            logger.warning("Job %s expired after %.0fs in the queue", job_id, age)
+            await update_job(
+                job_id,
+                status="failed",
+                error="Job expired before it could be processed. Please generate again.",
+                lease_owner=None,
+                lease_expires_at=None,
+            )
+            return
+
+        self.active += 1
+        work = asyncio.create_task(self._handler(job))
+        heartbeat = asyncio.create_task(self._heartbeat(job_id))
+        try:
+            await asyncio.wait({work, heartbeat}, return_when=asyncio.FIRST_COMPLETED)
+            if not work.done():
+                # The heartbeat only returns once another worker owns the job.
+                logger.warning("Job %s lost its lease; leaving it to the new owner", job_id)
+        finally:
+            work.cancel()
+            heartbeat.cancel()
+            results = await asyncio.gather(work, heartbeat, return_exceptions=True)
+            if isinstance(results[0], Exception):
+                logger.error("Job %s handler raised: %s", job_id, results[0], exc_info=results[0])
+            try:
+                await release_job_lease(job_id, self.owner)
+            finally:
+                self.active -= 1
+
+    async def _heartbeat(self, job_id: str) -> None:
+        """Renew the lease every third of its length; return if it was lost."""
+        while True:
+            await asyncio.sleep(config.JOB_LEASE_SEC / 3)
+            try:
+                if not await renew_job_lease(job_id, self.owner, config.JOB_LEASE_SEC):
+                    return
+            except Exception as exc:
+                logger.warning("Lease renewal for job %s failed: %s", job_id, exc)
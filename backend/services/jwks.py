@@ -0,0 +1,62 @@
+"""Supabase JWKS fetching, kept off the request path.
+
+``main.lifespan`` fetches the project's signing keys once at startup and
+``run`` re-fetches them every ``JWKS_REFRESH_SEC`` (or early, after a token
+named an unknown ``kid``). Keys are installed into ``utils.auth``, which only
+verifies against that in-memory set and never does network I/O itself. A
+failed fetch keeps the previous keys.
+"""
+
+import asyncio
+import logging
+import time
+
+import jwt
+
+import config
+from services.http_clients import clients as http_clients
+from utils.auth import set_signing_keys, watch_unknown_keys
+
+logger = logging.getLogger("strang.auth")
+
+JWKS_PATH = "/auth/v1/.well-known/jwks.json"
+
+
+class JwksRefresher:
+    def __init__(self) -> None:
+        self.fetched_at: float = 0.0
+        self.key_count: int = 0
+
+    async def refresh(self) -> bool:
+        """Fetch and install the key set; returns False (keeping old keys) on failure."""
+        self.fetched_at = time.monotonic()
+        try:
+            r = await http_clients.get("supabase").get(f"{config.SUPABASE_URL}{JWKS_PATH}", timeout=10.0)
+            r.raise_for_status()
+            keyset = jwt.PyJWKSet.from_dict(r.json())
+        except Exception as exc:
+            logger.warning("JWKS refresh failed: %s", exc)
+            return False
+        set_signing_keys({key.key_id: key for key in keyset.keys})
+        self.key_count = len(keyset.keys)
+        logger.info("Loaded %d Supabase signing key(s)", self.key_count)
+        return True
+
+    async def run(self) -> None:
+        """Refresh forever; started from ``main.lifespan`` when SUPABASE_URL is set."""
+        wanted = watch_unknown_keys()
+        while True:
+            try:
+                async with asyncio.timeout(config.JWKS_REFRESH_SEC):
+                    await wanted.wait()
+            except TimeoutError:
+                pass
+            # Tokens with made-up kids must not turn into a fetch per request.
+            wait = self.fetched_at + config.JWKS_MIN_REFRESH_SEC - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            wanted.clear()
+            await self.refresh()
+
+
+jwks = JwksRefresher()
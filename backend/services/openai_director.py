@@ -5,15 +5,12 @@ import logging
 
 import httpx
 from fastapi import HTTPException
-from tenacity import (
-    retry,
-    retry_if_exception_type,
-    stop_after_attempt,
-    wait_exponential,
-)
 
 import config
 from models.schemas import Screenplay
+from services.http_clients import clients as http_clients, is_server_error
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.retry_policy import send
 
 logger = logging.getLogger("strang.openai")
 
@@ -108,16 +105,15 @@ claim made by the source.
 - Return only the JSON object, no other text."""
 
 
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=2, max=10),
-    retry=retry_if_exception_type((httpx.TransportError, httpx.TimeoutException)),
-    reraise=True,
-)
 async def _call_openai(text: str, mode: str, goal: str, depth: str) -> httpx.Response:
-    """HTTP call to OpenAI with automatic retry on transport failures."""
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        return await client.post(
+    """HTTP call to OpenAI, retried on transport errors, 429s and 5xx (utils.retry_policy).
+
+    Each attempt goes through the "openai" circuit breaker, so an open circuit
+    ends the retries at once instead of waiting out the backoff.
+    """
+    breaker = get_breaker("openai")
+    return await send("openai", lambda: breaker.call(
+        lambda: http_clients.get("openai").post(
             "https://api.openai.com/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {config.OPENAI_API_KEY}",
@@ -138,7 +134,10 @@ async def _call_openai(text: str, mode: str, goal: str, depth: str) -> httpx.Res
                 "response_format": {"type": "json_object"},
                 "temperature": 0.1,  # lowered from 0.3 for more deterministic screenplays
             },
-        )
+            timeout=60.0,
+        ),
+        is_failure=is_server_error,
+    ))
 
 
 async def get_screenplay(
@@ -154,7 +153,13 @@ async def get_screenplay(
             detail="OPENAI_API_KEY is not set. Add it to your environment.",
         )
 
-    resp = await _call_openai(text, mode, goal, depth)
+    try:
+        resp = await _call_openai(text, mode, goal, depth)
+    except CircuitOpenError:
+        raise HTTPException(
+            status_code=503,
+            detail="OpenAI is temporarily unavailable. Please try again in a few minutes.",
+        )
 
     if resp.status_code != 200:
         err = resp.text
@@ -0,0 +1,266 @@
+"""Two-tier screenplay cache: in-process LRU in front of the SQLite table.
+
+Memory hits skip the database, zlib decompression, ``json.loads`` and
+``model_validate`` entirely. Hits are tallied in memory and written back in
+batches by the background eviction loop, which also expires idle entries and
+trims the table to ``SCREENPLAY_CACHE_MAX_MB``.
+
+Keys are computed over a canonical form of the passage, so selections that only
+differ in whitespace, quote style, Unicode form or citation markers share an
+entry. With ``SCREENPLAY_NEAR_DUP_THRESHOLD`` set, a SimHash index additionally
+serves screenplays for passages that are near-duplicates of a cached one.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+import config
+from models.schemas import Screenplay
+from storage.database import (
+    cache_screenplay,
+    evict_screenplay_cache,
+    get_cached_screenplay,
+    list_screenplay_fingerprints,
+    touch_cached_screenplays,
+)
+
+logger = logging.getLogger("strang.cache")
+
+_QUOTES = str.maketrans({
+    "\u2018": "'", "\u2019": "'", "\u201a": "'", "\u201b": "'", "\u2032": "'",
+    "\u201c": '"', "\u201d": '"', "\u201e": '"', "\u201f": '"', "\u2033": '"',
+    "\u00ab": '"', "\u00bb": '"',
+})
+# Wikipedia-style markers trailing a sentence or clause: "heart.[1]", "wall,[2][3-5] ...",
+# "defect.[citation needed]". Brackets inside text ("k[A][B]", "x[1] + 2") are kept.
+_CITATION_MARKER = re.compile(
+    r"(?<=[.!?,;:\"')])\s?"
+    r"(?:\[(?:\d+(?:\s*[-\u2013,]\s*\d+)*|citation needed|clarification needed)\])+"
+    r"(?=\s|$)",
+    re.IGNORECASE,
+)
+# Footnote superscripts ending a selection after punctuation ("...of the heart.¹²", not "x²").
+_TRAILING_SUPERSCRIPTS = re.compile(r"(?<=[.!?,;:\"')])[\u00b9\u00b2\u00b3\u2070-\u2079]+\s*$")
+_WHITESPACE = re.compile(r"\s+")
+_WORD = re.compile(r"\w+")
+
+_SIMHASH_BITS = 64
+
+
+def canonicalize_passage(text: str) -> str:
+    """Normalize a highlighted passage before it is hashed into a cache key."""
+    # NFC only: NFKC would fold "x²" into "x2" and merge passages that mean different things.
+    text = unicodedata.normalize("NFC", text.strip()).translate(_QUOTES)
+    text = _TRAILING_SUPERSCRIPTS.sub("", text)
+    text = _CITATION_MARKER.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def screenplay_cache_key(text: str, variant: str) -> str:
+    """sha256 over ``mode:goal:depth`` plus the canonical passage."""
+    return hashlib.sha256(f"{variant}:{canonicalize_passage(text)}".encode()).hexdigest()
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over lower-cased word 3-shingles of the canonical passage."""
+    words = _WORD.findall(canonicalize_passage(text).lower())
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+    weights = [0] * _SIMHASH_BITS
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for bit in range(_SIMHASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+class NearDuplicateIndex:
+    """Banded SimHash index: fingerprints within *max_distance* bits of a query.
+
+    Splitting the hash into ``max_distance + 1`` bands guarantees (pigeonhole) that
+    any fingerprint within range matches the query exactly on at least one band.
+    """
+
+    def __init__(self, max_distance: int) -> None:
+        self.max_distance = max(0, min(max_distance, _SIMHASH_BITS - 1))
+        bands = self.max_distance + 1
+        width, extra = divmod(_SIMHASH_BITS, bands)
+        self._bands: list[tuple[int, int]] = []
+        shift = 0
+        for i in range(bands):
+            size = width + (1 if i < extra else 0)
+            self._bands.append((shift, (1 << size) - 1))
+            shift += size
+        self._buckets: dict[tuple[str, int, int], set[str]] = {}
+        self._entries: dict[str, tuple[str, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _keys(self, variant: str, fingerprint: int):
+        for band, (shift, mask) in enumerate(self._bands):
+            yield (variant, band, (fingerprint >> shift) & mask)
+
+    def add(self, text_hash: str, variant: str, fingerprint: int) -> None:
+        self.discard(text_hash)
+        self._entries[text_hash] = (variant, fingerprint)
+        for key in self._keys(variant, fingerprint):
+            self._buckets.setdefault(key, set()).add(text_hash)
+
+    def discard(self, text_hash: str) -> None:
+        entry = self._entries.pop(text_hash, None)
+        if entry is None:
+            return
+        for key in self._keys(*entry):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(text_hash)
+                if not bucket:
+                    del self._buckets[key]
+
+    def nearest(self, variant: str, fingerprint: int) -> str | None:
+        best: tuple[int, str] | None = None
+        for key in self._keys(variant, fingerprint):
+            for text_hash in self._buckets.get(key, ()):
+                distance = (self._entries[text_hash][1] ^ fingerprint).bit_count()
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, text_hash)
+        return best[1] if best else None
+
+
+class ScreenplayCache:
+    def __init__(self, max_items: int, near_dup_threshold: float = 0.0) -> None:
+        self.max_items = max_items
+        self._memory: OrderedDict[str, Screenplay] = OrderedDict()
+        self._pending_hits: dict[str, int] = {}
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        # Similarity is 1 - hamming/64; a threshold of 0 disables near-duplicate serving.
+        self._near: NearDuplicateIndex | None = None
+        if near_dup_threshold > 0:
+            self._near = NearDuplicateIndex(int((1 - near_dup_threshold) * _SIMHASH_BITS))
+        self._indexed_until = 0.0
+
+    def _remember(self, text_hash: str, screenplay: Screenplay) -> None:
+        if self.max_items <= 0:
+            return
+        self._memory[text_hash] = screenplay
+        self._memory.move_to_end(text_hash)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    async def _lookup(self, text_hash: str) -> tuple[Screenplay | None, bool]:
+        """(screenplay, served from memory); queues the hit for write-back."""
+        screenplay = self._memory.get(text_hash)
+        in_memory = screenplay is not None
+        if in_memory:
+            self._memory.move_to_end(text_hash)
+        else:
+            cached = await get_cached_screenplay(text_hash)
+            if cached is None:
+                return None, False
+            screenplay = Screenplay.model_validate(cached)
+            self._remember(text_hash, screenplay)
+        self._pending_hits[text_hash] = self._pending_hits.get(text_hash, 0) + 1
+        return screenplay, in_memory
+
+    async def get(self, text_hash: str) -> Screenplay | None:
+        screenplay, in_memory = await self._lookup(text_hash)
+        if screenplay is None:
+            self.misses += 1
+        elif in_memory:
+            self.memory_hits += 1
+        else:
+            self.db_hits += 1
+        return screenplay
+
+    async def get_similar(self, text: str, variant: str) -> Screenplay | None:
+        """Serve the cached screenplay of a near-duplicate passage, if enabled.
+
+        Called after ``get`` missed, so only ``near_hits`` is counted here.
+        """
+        if self._near is None:
+            return None
+        text_hash = self._near.nearest(variant, simhash(text))
+        if text_hash is None:
+            return None
+        screenplay, _ = await self._lookup(text_hash)
+        if screenplay is None:
+            # Evicted by another process since the index was refreshed.
+            self._near.discard(text_hash)
+            return None
+        self.near_hits += 1
+        return screenplay
+
+    async def put(self, text_hash: str, screenplay: Screenplay, text: str, variant: str) -> None:
+        # Fingerprints are always stored so the index can be enabled later.
+        fingerprint = simhash(text)
+        await cache_screenplay(
+            text_hash, screenplay.model_dump_json(), variant, f"{fingerprint:016x}",
+        )
+        self._remember(text_hash, screenplay)
+        if self._near is not None:
+            self._near.add(text_hash, variant, fingerprint)
+
+    async def refresh_index(self) -> None:
+        """Index fingerprints written since the last refresh (also by other processes)."""
+        if self._near is None:
+            return
+        since, self._indexed_until = self._indexed_until, time.time()
+        for text_hash, variant, fingerprint in await list_screenplay_fingerprints(since):
+            self._near.add(text_hash, variant, int(fingerprint, 16))
+
+    async def flush_hits(self) -> None:
+        hits, self._pending_hits = self._pending_hits, {}
+        await touch_cached_screenplays(hits, time.time())
+
+    async def evict(self) -> list[str]:
+        """Write back hit stats, then apply the TTL and size limits to the table."""
+        await self.flush_hits()
+        idle_before = time.time() - config.SCREENPLAY_CACHE_TTL_DAYS * 86400
+        max_bytes = config.SCREENPLAY_CACHE_MAX_MB * 1024 * 1024
+        evicted = await evict_screenplay_cache(idle_before, max_bytes)
+        for text_hash in evicted:
+            self._memory.pop(text_hash, None)
+            if self._near is not None:
+                self._near.discard(text_hash)
+        if evicted:
+            logger.info("Evicted %d screenplay cache entries", len(evicted))
+        return evicted
+
+    async def run(self) -> None:
+        """Evict forever; started from ``main.lifespan``."""
+        while True:
+            await asyncio.sleep(config.SCREENPLAY_CACHE_EVICT_INTERVAL_SEC)
+            try:
+                await self.evict()
+                await self.refresh_index()
+            except Exception as exc:
+                logger.warning("Screenplay cache eviction failed: %s", exc)
+
+    def stats(self) -> dict:
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            # Every request does one exact lookup; a near-duplicate hit serves one that missed.
+            "hit_rate": round(
+                (self.memory_hits + self.db_hits + self.near_hits) / lookups, 3
+            ) if lookups else None,
+            "near_dup_indexed": len(self._near) if self._near is not None else None,
+        }
+
+
+screenplay_cache = ScreenplayCache(
+    config.SCREENPLAY_CACHE_MEMORY_ITEMS,
+    config.SCREENPLAY_NEAR_DUP_THRESHOLD,
+)
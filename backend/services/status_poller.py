@@ -0,0 +1,178 @@
+"""Background poller that moves ``processing`` jobs to their final state.
+
+Every ``STATUS_POLL_INTERVAL_SEC`` it claims the processing jobs not checked
+since the last round, asks HeyGen about them with bounded concurrency, and
+writes completions / failures to ``jobs``. The status endpoint therefore only
+reads the database, and HeyGen sees one status call per job per interval no
+matter how many clients are polling. When HeyGen webhooks are configured they
+deliver completions (``record_provider_status``) and polling only runs every
+``STATUS_POLL_FALLBACK_INTERVAL_SEC`` to catch missed callbacks.
+"""
+
+import asyncio
+import logging
+import time
+
+import config
+from services.heygen_service import heygen_get_status
+from storage.database import cache_render, claim_status_checks, update_job
+from storage.shared_state import cache_store
+from utils.circuit_breaker import CircuitOpenError
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger("strang.status")
+
+# ---------------------------------------------------------------------------
+# Provider status cache — collapses checks for the same video when the poll
+# interval is shorter than the TTL. Bounded, and entries keep only the fields
+# ``record_provider_status`` reads, not HeyGen's full payload.
+# ---------------------------------------------------------------------------
+def _new_status_cache() -> TTLCache[dict]:
+    return TTLCache(
+        maxsize=config.STATUS_CACHE_MAX_ENTRIES,
+        ttl=config.STATUS_CACHE_TTL_SEC,
+        stale_ttl=config.STATUS_CACHE_STALE_SEC,
+        jitter=config.STATUS_CACHE_TTL_JITTER,
+        store=cache_store("heygen_status", config.STATUS_CACHE_MAX_ENTRIES),
+    )
+
+
+_status_cache = _new_status_cache()
+
+# HeyGen jobs that stay in "processing" beyond this threshold are force-failed.
+_HEYGEN_TIMEOUT_MINUTES = 15
+
+_LEGACY_ENGINE_ERROR = (
+    "This job used the legacy OpenAI video engine, which is no longer available. "
+    "Please generate again — videos are now rendered with HeyGen only."
+)
+
+
+async def _fetch_heygen_status(video_id: str) -> dict:
+    result = await heygen_get_status(video_id)
+    return {k: result[k] for k in ("status", "video_url", "error") if result.get(k) is not None}
+
+
+async def _get_cached_heygen_status(video_id: str) -> dict:
+    """Return the cached HeyGen status (possibly stale, refreshing behind it) or fetch it."""
+    return await _status_cache.get(video_id, lambda: _fetch_heygen_status(video_id))
+
+
+async def _evict_status_cache(video_id: str) -> None:
+    """Remove a video from the status cache once its job reaches a terminal state."""
+    await _status_cache.pop(video_id)
+
+
+async def _fail(job_id: str, video_id: str, error: str) -> None:
+    await update_job(job_id, status="failed", error=error)
+    await _evict_status_cache(video_id)
+
+
+async def check_job(job: dict) -> None:
+    """Fetch provider status for one processing job and record any transition."""
+    job_id = job["id"]
+    video_id = job.get("video_id")
+    if not video_id:
+        return
+
+    if (job.get("engine") or "heygen").lower() == "openai":
+        await _fail(job_id, video_id, _LEGACY_ENGINE_ERROR)
+        return
+
+    # Timeout guard: fail jobs that have been processing too long to prevent
+    # them hanging indefinitely if HeyGen never responds. Measured from when
+    # the render started, not from creation: a job may wait in the queue first.
+    started_at = job.get("processing_started_at") or job.get("created_at")
+    if started_at:
+        try:
+            render_minutes = (time.time() - float(started_at)) / 60
+            if render_minutes > _HEYGEN_TIMEOUT_MINUTES:
+                error = f"HeyGen job timed out after {_HEYGEN_TIMEOUT_MINUTES} minutes"
+                logger.warning("Job %s timed out: %s", job_id, error)
+                await _fail(job_id, video_id, error)
+                return
+        except (TypeError, ValueError):
+            pass
+
+    try:
+        result = await _get_cached_heygen_status(video_id)
+    except CircuitOpenError:
+        return  # HeyGen is down; the job stays processing and is checked next round
+    except Exception as exc:
+        error = f"HeyGen status check failed: {exc}"
+        logger.error("Job %s polling failed: %s", job_id, error)
+        await _fail(job_id, video_id, error)
+        return
+    await record_provider_status(job, result)
+
+
+async def record_provider_status(job: dict, result: dict) -> None:
+    """Apply a HeyGen status (from a poll or a webhook) to a processing job."""
+    job_id = job["id"]
+    video_id = job["video_id"]
+    provider_status = result.get("status", "pending")
+    if provider_status == "completed":
+        url = result.get("video_url")
+        if not url:
+            await _fail(job_id, video_id, "HeyGen completed the job but no video URL was returned.")
+            return
+        await update_job(job_id, status="completed", video_url=url)
+        await _evict_status_cache(video_id)
+        if job.get("prompt_hash"):
+            expire_before = time.time() - config.RENDER_CACHE_TTL_HOURS * 3600
+            await cache_render(job["prompt_hash"], video_id, url, expire_before)
+        logger.info("Job %s completed (video_id=%s)", job_id, video_id)
+    elif provider_status in ("failed", "error"):
+        await _fail(job_id, video_id, result.get("error", "HeyGen reported failure"))
+
+
+def poll_interval() -> float:
+    if config.HEYGEN_WEBHOOK_URL and config.HEYGEN_WEBHOOK_SECRET:
+        return config.STATUS_POLL_FALLBACK_INTERVAL_SEC
+    return config.STATUS_POLL_INTERVAL_SEC
+
+
+class StatusPoller:
+    def __init__(self) -> None:
+        self.last_polled_at: float = 0.0
+        self.last_batch: int = 0
+
+    def stats(self) -> dict:
+        return {
+            "last_polled_at": self.last_polled_at,
+            "last_batch": self.last_batch,
+            "status_cache": _status_cache.stats(),
+        }
+
+    async def poll_once(self) -> int:
+        """Check every processing job that is due; returns how many were checked."""
+        jobs = await claim_status_checks(
+            time.time() - poll_interval(), config.STATUS_POLL_BATCH_SIZE
+        )
+        semaphore = asyncio.Semaphore(max(1, config.STATUS_POLL_CONCURRENCY))
+
+        async def _check(job: dict) -> None:
+            async with semaphore:
+                try:
+                    await check_job(job)
+                except Exception as exc:
+                    logger.warning("Status check for job %s failed: %s", job["id"], exc)
+
+        await asyncio.gather(*(_check(job) for job in jobs))
+        self.last_polled_at = time.time()
+        self.last_batch = len(jobs)
+        return len(jobs)
+
+    async def run(self) -> None:
+        """Poll forever; started from ``main.lifespan``."""
+        while True:
+            try:
+                # A full batch means more jobs are due; go again without sleeping.
+                if await self.poll_once() >= config.STATUS_POLL_BATCH_SIZE:
+                    continue
+            except Exception as exc:
+                logger.warning("Status poll failed: %s", exc)
+            await asyncio.sleep(poll_interval())
+
+
+poller = StatusPoller()
@@ -0,0 +1,120 @@
+"""Video generation pipeline run by queue workers.
+
+Shared by the API process (embedded workers) and the standalone ``worker``
+entry point, so both claim and process jobs exactly the same way.
+"""
+
+import logging
+import time
+
+from fastapi import HTTPException
+
+import config
+from models.schemas import Screenplay
+from services.heygen_service import heygen_create_video, render_cache_key
+from services.openai_director import get_screenplay
+from services.screenplay_cache import screenplay_cache, screenplay_cache_key
+from storage.database import (
+    get_cached_render,
+    increment_videos_generated,
+    update_job,
+)
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger("strang")
+
+# Concurrent jobs for the same passage (e.g. a class assignment) share one OpenAI
+# call, and jobs whose screenplays match share one HeyGen render.
+screenplay_flights: SingleFlight[Screenplay] = SingleFlight()
+render_flights: SingleFlight[str] = SingleFlight()
+
+
+async def process_video_job(
+    job_id: str,
+    text: str,
+    user_id: str | None = None,
+    mode: str = "study",
+    goal: str = "understand",
+    depth: str = "standard",
+) -> None:
+    """OpenAI screenplay -> HeyGen video creation for one job."""
+    try:
+        variant = f"{mode}:{goal}:{depth}"
+        text_hash = screenplay_cache_key(text, variant)
+        screenplay = (
+            await screenplay_cache.get(text_hash)
+            or await screenplay_cache.get_similar(text, variant)
+        )
+
+        if screenplay:
+            logger.info("Cache hit for job %s", job_id)
+        else:
+            async def _generate() -> Screenplay:
+                generated = await get_screenplay(text, mode=mode, goal=goal, depth=depth)
+                await screenplay_cache.put(text_hash, generated, text, variant)
+                return generated
+
+            screenplay = await screenplay_flights.do(text_hash, _generate)
+            logger.info("Screenplay generated for job %s", job_id)
+
+        learning = {
+            "project_title": screenplay.project_title,
+            "key_takeaway": screenplay.key_takeaway,
+            "comprehension_question": screenplay.comprehension_question,
+            "comprehension_answer": screenplay.comprehension_answer,
+        }
+        prompt_hash = render_cache_key(screenplay)
+        render = None
+        if config.RENDER_CACHE_TTL_HOURS > 0:
+            fresh_after = time.time() - config.RENDER_CACHE_TTL_HOURS * 3600
+            render = await get_cached_render(prompt_hash, fresh_after)
+
+        if render:
+            await update_job(
+                job_id,
+                video_id=render["video_id"],
+                video_url=render["video_url"],
+                status="completed",
+                prompt_hash=prompt_hash,
+                **learning,
+            )
+            logger.info("Render cache hit for job %s (video_id=%s)", job_id, render["video_id"])
+        else:
+            video_id = await render_flights.do(
+                prompt_hash, lambda: heygen_create_video(screenplay, callback_id=job_id)
+            )
+            await update_job(
+                job_id,
+                video_id=video_id,
+                status="processing",
+                processing_started_at=time.time(),
+                prompt_hash=prompt_hash,
+                **learning,
+            )
+            logger.info(
+                "HeyGen video queued for job %s (video_id=%s)",
+                job_id,
+                video_id,
+            )
+
+        if user_id and user_id not in ("admin", "anonymous"):
+            await increment_videos_generated(user_id)
+
+    except HTTPException as exc:
+        logger.error("Job %s failed: %s", job_id, exc.detail)
+        await update_job(job_id, status="failed", error=exc.detail)
+    except Exception as exc:
+        logger.error("Job %s failed unexpectedly: %s", job_id, exc, exc_info=True)
+        await update_job(job_id, status="failed", error=str(exc))
+
+
+async def run_queued_job(job: dict) -> None:
+    """JobQueue handler: run the pipeline for a claimed ``jobs`` row."""
+    await process_video_job(
+        job["id"],
+        job.get("input_text") or "",
+        job.get("user_id"),
+        job.get("mode") or "study",
+        job.get("goal") or "understand",
+        job.get("depth") or "standard",
+    )
@@ -0,0 +1,55 @@
+"""Periodically refreshed waitlist count + referral leaderboard.
+
+The landing page polls these numbers, so they are served from memory and only
+re-read from SQLite every ``WAITLIST_SNAPSHOT_INTERVAL_SEC``. Signups handled
+by this process update the count immediately.
+"""
+
+import asyncio
+import logging
+import time
+
+import config
+from storage.database import get_waitlist_count, get_waitlist_leaderboard
+
+logger = logging.getLogger("strang.waitlist")
+
+
+def mask_email(email: str) -> str:
+    """Hide most of the local part: ``jane.doe@x.com`` → ``ja***@x.com``."""
+    local, _, domain = email.partition("@")
+    return f"{local[:2]}***@{domain}" if domain else f"{local[:2]}***"
+
+
+class WaitlistSnapshot:
+    def __init__(self) -> None:
+        self.count: int | None = None
+        self.leaderboard: list[dict] = []
+        self.updated_at: float = 0.0  # last change, so unchanged data keeps its ETag
+
+    async def refresh(self) -> None:
+        count = await get_waitlist_count()
+        rows = await get_waitlist_leaderboard(config.WAITLIST_LEADERBOARD_SIZE)
+        leaderboard = [{**row, "email": mask_email(row["email"])} for row in rows]
+        if count != self.count or leaderboard != self.leaderboard:
+            self.count = count
+            self.leaderboard = leaderboard
+            self.updated_at = time.time()
+
+    def note_signup(self, total: int) -> None:
+        """Adopt the post-signup total so this process never serves a count behind it."""
+        if self.count is None or total > self.count:
+            self.count = total
+            self.updated_at = time.time()
+
+    async def run(self) -> None:
+        """Refresh forever; started from ``main.lifespan``."""
+        while True:
+            await asyncio.sleep(config.WAITLIST_SNAPSHOT_INTERVAL_SEC)
+            try:
+                await self.refresh()
+            except Exception as exc:
+                logger.warning("Waitlist snapshot refresh failed: %s", exc)
+
+
+snapshot = WaitlistSnapshot()
@@ -2,165 +2,216 @@
 
 Provides async CRUD for jobs, waitlist, and screenplay cache.
 Uses aiosqlite (thin async wrapper around sqlite3).
+
+Connections come from a long-lived pool opened in ``main.lifespan``: one writer
+connection (SQLite allows a single writer at a time anyway) plus a few reader
+connections, all in WAL mode so reads never block on the writer. Outside the
+app lifecycle (scripts, unit tests) each call falls back to a short-lived
+connection with the same pragmas.
 """
 
+import asyncio
 import json
 import secrets
 import string
 import time
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
 import aiosqlite
 
 import config
+from storage.migrations import migrate
+from utils.pubsub import Broadcaster
+from utils.ttl_cache import TTLCache
 
 _db_path = config.DB_PATH
 
+# Published with the job id after every ``update_job`` in this process
+# (status streams in main subscribe to it).
+job_updates = Broadcaster()
 
-def _generate_referral_code() -> str:
-    """Generate an 8-character alphanumeric referral code."""
-    alphabet = string.ascii_uppercase + string.digits
-    return "".join(secrets.choice(alphabet) for _ in range(8))
 
+async def _connect(path: str) -> aiosqlite.Connection:
+    """Open a connection with the per-connection pragmas every caller relies on."""
+    db = await aiosqlite.connect(path)
+    db.row_factory = aiosqlite.Row
+    await _pragma(db, f"busy_timeout = {int(config.DB_BUSY_TIMEOUT_MS)}")
+    await _pragma(db, "synchronous = NORMAL")
+    return db
 
-async def _ensure_waitlist_referral_columns(db: aiosqlite.Connection) -> None:
-    """Backfill schema for older databases by adding referral columns when missing."""
-    cursor = await db.execute("PRAGMA table_info(waitlist)")
-    cols = await cursor.fetchall()
-    names = {c[1] for c in cols}
-    if "referral_code" not in names:
-        await db.execute(
-            "ALTER TABLE waitlist ADD COLUMN referral_code TEXT"
-        )
-    if "referred_by" not in names:
-        await db.execute(
-            "ALTER TABLE waitlist ADD COLUMN referred_by TEXT"
-        )
-    if "referral_count" not in names:
-        await db.execute(
-            "ALTER TABLE waitlist ADD COLUMN referral_count INTEGER NOT NULL DEFAULT 0"
-        )
 
+async def _pragma(db: aiosqlite.Connection, statement: str) -> None:
+    """Run a PRAGMA and finalize its cursor right away.
 
-async def _ensure_jobs_engine_column(db: aiosqlite.Connection) -> None:
-    """Backfill schema for older databases by adding jobs.engine when missing."""
-    cursor = await db.execute("PRAGMA table_info(jobs)")
-    cols = await cursor.fetchall()
-    names = {c[1] for c in cols}
-    if "engine" not in names:
-        await db.execute(
-            "ALTER TABLE jobs ADD COLUMN engine TEXT NOT NULL DEFAULT 'heygen'"
-        )
-
-
-async def _ensure_jobs_extension_count_column(db: aiosqlite.Connection) -> None:
-    """Backfill schema for older databases by adding jobs.extension_count when missing."""
-    cursor = await db.execute("PRAGMA table_info(jobs)")
-    cols = await cursor.fetchall()
-    names = {c[1] for c in cols}
-    if "extension_count" not in names:
-        await db.execute(
-            "ALTER TABLE jobs ADD COLUMN extension_count INTEGER NOT NULL DEFAULT 0"
-        )
+    A pragma that returns a row keeps its statement (and the lock it took) open
+    until the cursor is closed, which would block the other pooled connections.
+    """
+    async with db.execute(f"PRAGMA {statement}"):
+        pass
+
+
+class ConnectionPool:
+    """Single writer + N reader connections to one SQLite database in WAL mode."""
+
+    def __init__(self, path: str, readers: int) -> None:
+        self.path = path
+        self._reader_count = max(1, readers)
+        self._readers: asyncio.Queue[aiosqlite.Connection] = asyncio.Queue()
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self) -> None:
+        self._writer = await _connect(self.path)
+        # journal_mode is persistent in the file; set it once from the writer.
+        await _pragma(self._writer, "journal_mode = WAL")
+        for _ in range(self._reader_count):
+            db = await _connect(self.path)
+            self._all_readers.append(db)
+            self._readers.put_nowait(db)
+
+    async def close(self) -> None:
+        for db in self._all_readers:
+            await db.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def reader(self) -> AsyncIterator[aiosqlite.Connection]:
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Serialize writers; commit on success, roll back on error."""
+        if self._writer is None:
+            raise RuntimeError("Connection pool is not open")
+        async with self._write_lock:
+            try:
+                yield self._writer
+                await self._writer.commit()
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+_pool: ConnectionPool | None = None
+
+
+async def open_pool() -> None:
+    """Open the shared pool for the current database path. Called from lifespan."""
+    global _pool
+    await close_pool()
+    pool = ConnectionPool(str(_db_path), config.DB_READ_POOL_SIZE)
+    await pool.open()
+    _pool = pool
+
+
+async def close_pool() -> None:
+    """Close every pooled connection. Safe to call when no pool is open."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+@asynccontextmanager
+async def _read() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow a reader connection (or a one-off connection when no pool is open)."""
+    if _pool is not None:
+        async with _pool.reader() as db:
+            yield db
+        return
+    db = await _connect(str(_db_path))
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
+@asynccontextmanager
+async def _write() -> AsyncIterator[aiosqlite.Connection]:
+    """Borrow the writer connection; the block is committed as one transaction."""
+    if _pool is not None:
+        async with _pool.writer() as db:
+            yield db
+        return
+    db = await _connect(str(_db_path))
+    try:
+        yield db
+        await db.commit()
+    finally:
+        await db.close()
+
+
+# Hot queries shared with tests/test_query_plans.py, which pins them to their indexes.
+_LIST_USER_JOBS_SQL = """
+    SELECT id, status, video_url, project_title, key_takeaway, mode, goal,
+           depth, input_text, created_at, updated_at
+    FROM jobs
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+    LIMIT ?
+"""
+_USER_BY_STRIPE_CUSTOMER_SQL = "SELECT * FROM users WHERE stripe_customer_id = ?"
+_WAITLIST_REFERRER_SQL = "SELECT id FROM waitlist WHERE referral_code = ? COLLATE NOCASE"
+_WAITLIST_COUNT_SQL = "SELECT value FROM counters WHERE name = 'waitlist'"
+_WAITLIST_POSITION_SQL = """
+    WITH me AS (
+        SELECT referral_count, created_at FROM waitlist WHERE email = ? COLLATE NOCASE
+    )
+    SELECT 1
+        + (SELECT COUNT(*) FROM waitlist AS w
+           WHERE w.referral_count > me.referral_count)
+        + (SELECT COUNT(*) FROM waitlist AS w
+           WHERE w.referral_count = me.referral_count AND w.created_at < me.created_at)
+    FROM me
+"""
+_CLAIM_STATUS_CHECKS_SQL = """
+    UPDATE jobs SET status_checked_at = ?
+    WHERE id IN (
+        SELECT id FROM jobs
+        WHERE status = 'processing' AND status_checked_at < ?
+        ORDER BY status_checked_at
+        LIMIT ?
+    )
+    RETURNING *
+"""
+_ROLL_RATE_LIMIT_SQL = """
+    INSERT INTO rate_limits (key, window_start) VALUES (?, ?)
+    ON CONFLICT(key) DO UPDATE SET
+        previous = CASE
+            WHEN window_start = excluded.window_start THEN previous
+            WHEN window_start = excluded.window_start - ? THEN current
+            ELSE 0 END,
+        current = CASE WHEN window_start = excluded.window_start THEN current ELSE 0 END,
+        window_start = excluded.window_start
+    RETURNING current, previous
+"""
 
 
-async def _ensure_jobs_learning_columns(db: aiosqlite.Connection) -> None:
-    """Backfill ownership, personalization, and learning-result fields."""
-    cursor = await db.execute("PRAGMA table_info(jobs)")
-    cols = await cursor.fetchall()
-    names = {c[1] for c in cols}
-    additions = {
-        "user_id": "TEXT",
-        "mode": "TEXT NOT NULL DEFAULT 'study'",
-        "goal": "TEXT NOT NULL DEFAULT 'understand'",
-        "depth": "TEXT NOT NULL DEFAULT 'standard'",
-        "project_title": "TEXT",
-        "key_takeaway": "TEXT",
-        "comprehension_question": "TEXT",
-        "comprehension_answer": "TEXT",
-    }
-    for name, definition in additions.items():
-        if name not in names:
-            await db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
-
-
-async def _ensure_users_billing_columns(db: aiosqlite.Connection) -> None:
-    """Backfill billing-period fields and current free-plan limits."""
-    cursor = await db.execute("PRAGMA table_info(users)")
-    cols = await cursor.fetchall()
-    names = {c[1] for c in cols}
-    if "current_period_start" not in names:
-        await db.execute("ALTER TABLE users ADD COLUMN current_period_start REAL")
-    await db.execute(
-        "UPDATE users SET videos_limit = ? WHERE plan = 'free'",
-        (config.FREE_TIER_VIDEO_LIMIT,),
-    )
+def _generate_referral_code() -> str:
+    """Generate an 8-character alphanumeric referral code."""
+    alphabet = string.ascii_uppercase + string.digits
+    return "".join(secrets.choice(alphabet) for _ in range(8))
 
 
 async def init_db() -> None:
-    """Create tables if they don't exist. Called once at startup."""
+    """Bring the schema up to date. Called once at startup.
+
+    See ``storage.migrations``; a current database costs one pragma read.
+    """
     _db_path.parent.mkdir(parents=True, exist_ok=True)
-    async with aiosqlite.connect(str(_db_path)) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS jobs (
-                id           TEXT PRIMARY KEY,
-                status       TEXT NOT NULL DEFAULT 'pending',
-                engine       TEXT NOT NULL DEFAULT 'heygen',
-                extension_count INTEGER NOT NULL DEFAULT 0,
-                video_id     TEXT,
-                video_url    TEXT,
-                error        TEXT,
-                input_text   TEXT,
-                user_id      TEXT,
-                mode         TEXT NOT NULL DEFAULT 'study',
-                goal         TEXT NOT NULL DEFAULT 'understand',
-                depth        TEXT NOT NULL DEFAULT 'standard',
-                project_title TEXT,
-                key_takeaway TEXT,
-                comprehension_question TEXT,
-                comprehension_answer TEXT,
-                created_at   REAL NOT NULL,
-                updated_at   REAL NOT NULL
-            )
-        """)
-        await _ensure_jobs_engine_column(db)
-        await _ensure_jobs_extension_count_column(db)
-        await _ensure_jobs_learning_columns(db)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS waitlist (
-                id             INTEGER PRIMARY KEY AUTOINCREMENT,
-                email          TEXT NOT NULL UNIQUE COLLATE NOCASE,
-                referral_code  TEXT UNIQUE,
-                referred_by    TEXT,
-                referral_count INTEGER NOT NULL DEFAULT 0,
-                created_at     REAL NOT NULL
-            )
-        """)
-        await _ensure_waitlist_referral_columns(db)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS screenplay_cache (
-                text_hash       TEXT PRIMARY KEY,
-                screenplay_json TEXT NOT NULL,
-                created_at      REAL NOT NULL
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id                  TEXT PRIMARY KEY,
-                email               TEXT NOT NULL,
-                stripe_customer_id  TEXT,
-                subscription_status TEXT NOT NULL DEFAULT 'free',
-                subscription_id     TEXT,
-                plan                TEXT NOT NULL DEFAULT 'free',
-                videos_generated    INTEGER NOT NULL DEFAULT 0,
-                videos_limit        INTEGER NOT NULL DEFAULT 1,
-                current_period_start REAL,
-                current_period_end  REAL,
-                created_at          REAL NOT NULL,
-                updated_at          REAL NOT NULL
-            )
-        """)
-        await _ensure_users_billing_columns(db)
-        await db.commit()
+    async with _write() as db:
+        await migrate(db)
 
 
 # ---------------------------------------------------------------------------
@@ -177,14 +228,13 @@ async def create_job(
     depth: str = "standard",
 ) -> dict:
     now = time.time()
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         await db.execute(
             "INSERT INTO jobs "
             "(id, status, engine, input_text, user_id, mode, goal, depth, created_at, updated_at) "
             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
             (job_id, "pending", engine, input_text, user_id, mode, goal, depth, now, now),
         )
-        await db.commit()
     return {
         "id": job_id, "status": "pending",
         "engine": engine, "video_id": None, "video_url": None, "error": None,
@@ -192,25 +242,13 @@ async def create_job(
 
 
 async def list_user_jobs(user_id: str, limit: int = 20) -> list[dict]:
-    async with aiosqlite.connect(str(_db_path)) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            """
-            SELECT id, status, video_url, project_title, key_takeaway, mode, goal,
-                   depth, input_text, created_at, updated_at
-            FROM jobs
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-            """,
-            (user_id, limit),
-        )
+    async with _read() as db:
+        cursor = await db.execute(_LIST_USER_JOBS_SQL, (user_id, limit))
         return [dict(row) for row in await cursor.fetchall()]
 
 
 async def get_job(job_id: str) -> dict | None:
-    async with aiosqlite.connect(str(_db_path)) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
@@ -222,9 +260,123 @@ async def update_job(job_id: str, **fields: object) -> None:
     fields["updated_at"] = time.time()
     set_clause = ", ".join(f"{k} = ?" for k in fields)
     values = list(fields.values()) + [job_id]
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         await db.execute(f"UPDATE jobs SET {set_clause} WHERE id = ?", values)
-        await db.commit()
+    job_updates.publish(job_id)
+
+
+# ---------------------------------------------------------------------------
+# Job queue (pending jobs, claimed with expiring leases)
+# ---------------------------------------------------------------------------
+
+async def claim_job(owner: str, lease_sec: float) -> dict | None:
+    """Lease the oldest unleased (or lease-expired) pending job to *owner*.
+
+    The select-and-update is one statement on the single writer, so two workers
+    (or two processes) can never claim the same job.
+    """
+    now = time.time()
+    async with _write() as db:
+        cursor = await db.execute(
+            """
+            UPDATE jobs
+            SET lease_owner = ?, lease_expires_at = ?, claimed_at = ?, attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status = 'pending'
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                ORDER BY created_at
+                LIMIT 1
+            )
+            RETURNING *
+            """,
+            (owner, now + lease_sec, now, now),
+        )
+        rows = await cursor.fetchall()
+        return dict(rows[0]) if rows else None
+
+
+async def renew_job_lease(job_id: str, owner: str, lease_sec: float) -> bool:
+    """Extend *owner*'s lease. False means the lease was lost to another worker."""
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND lease_owner = ?",
+            (time.time() + lease_sec, job_id, owner),
+        )
+        return cursor.rowcount == 1
+
+
+async def release_job_lease(job_id: str, owner: str) -> None:
+    async with _write() as db:
+        await db.execute(
+            "UPDATE jobs SET lease_owner = NULL, lease_expires_at = NULL "
+            "WHERE id = ? AND lease_owner = ?",
+            (job_id, owner),
+        )
+
+
+async def count_queued_jobs() -> int:
+    """Number of pending jobs, leased or not (served by idx_jobs_queue)."""
+    async with _read() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'")
+        row = await cursor.fetchone()
+        return row[0] if row else 0
+
+
+async def queue_load() -> tuple[int, int]:
+    """(pending jobs, how many of them a worker in any process is running now)."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(lease_expires_at > ?), 0) FROM jobs WHERE status = 'pending'",
+            (time.time(),),
+        )
+        row = await cursor.fetchone()
+        return (row[0], row[1]) if row else (0, 0)
+
+
+# Worker time of the last N jobs run to the end of the pipeline: from claim until the
+# render was started (or the job completed from cache or failed).
+_RECENT_SERVICE_TIME_SQL = """
+    SELECT COALESCE(processing_started_at, updated_at) - claimed_at
+    FROM jobs
+    WHERE claimed_at IS NOT NULL AND status != 'pending'
+    ORDER BY claimed_at DESC
+    LIMIT ?
+"""
+
+
+async def recent_service_time(limit: int) -> float | None:
+    """Mean seconds a worker spent per job over the last *limit* jobs, or None."""
+    async with _read() as db:
+        cursor = await db.execute(_RECENT_SERVICE_TIME_SQL, (limit,))
+        durations = [row[0] for row in await cursor.fetchall()]
+    return sum(durations) / len(durations) if durations else None
+
+
+# ---------------------------------------------------------------------------
+# Provider status polling (processing jobs)
+# ---------------------------------------------------------------------------
+
+async def claim_status_checks(checked_before: float, limit: int) -> list[dict]:
+    """Stamp and return up to *limit* processing jobs not checked since *checked_before*.
+
+    Least recently checked first. Stamping in the same statement means pollers in
+    several processes split the jobs between them instead of checking each twice.
+    """
+    async with _write() as db:
+        cursor = await db.execute(
+            _CLAIM_STATUS_CHECKS_SQL, (time.time(), checked_before, limit)
+        )
+        return [dict(row) for row in await cursor.fetchall()]
+
+
+async def list_processing_jobs_for_video(video_id: str) -> list[dict]:
+    """Processing jobs waiting on *video_id* (several when they shared one render)."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT * FROM jobs WHERE status = 'processing' AND video_id = ?", (video_id,)
+        )
+        return [dict(row) for row in await cursor.fetchall()]
 
 
 # ---------------------------------------------------------------------------
@@ -233,8 +385,7 @@ async def update_job(job_id: str, **fields: object) -> None:
 
 async def get_waitlist_entry(email: str) -> dict | None:
     """Return a single waitlist row by email, or None."""
-    async with aiosqlite.connect(str(_db_path)) as db:
-        db.row_factory = aiosqlite.Row
+    async with _read() as db:
         cursor = await db.execute(
             "SELECT * FROM waitlist WHERE email = ? COLLATE NOCASE", (email.strip().lower(),)
         )
@@ -243,141 +394,332 @@ async def get_waitlist_entry(email: str) -> dict | None:
 
 
 async def get_waitlist_position(email: str) -> int:
-    """Return 1-based queue position ordered by referral_count DESC, created_at ASC."""
-    async with aiosqlite.connect(str(_db_path)) as db:
-        cursor = await db.execute(
-            """
-            SELECT pos FROM (
-                SELECT email,
-                       ROW_NUMBER() OVER (ORDER BY referral_count DESC, created_at ASC) AS pos
-                FROM waitlist
-            ) ranked
-            WHERE email = ? COLLATE NOCASE
-            """,
-            (email.strip().lower(),),
-        )
+    """Return 1-based queue position ordered by referral_count DESC, created_at ASC.
+
+    The rank is 1 + the rows ahead of this entry, counted on ``idx_waitlist_rank``,
+    which SQLite keeps ordered as referrals bump ``referral_count``.
+    """
+    async with _read() as db:
+        cursor = await db.execute(_WAITLIST_POSITION_SQL, (email.strip().lower(),))
         row = await cursor.fetchone()
         return row[0] if row else 0
 
 
 async def add_email(email: str, referred_by_code: str | None = None) -> dict:
-    """Add email with optional referral code.
+    """Add email with optional referral code, in one write transaction.
 
     Returns a dict:
       is_new        – True if this was a fresh signup
       referral_code – the user's own share code
       position      – 1-based queue position after insert
       referral_count – how many referrals this entry has so far
+      total         – number of waitlist signups after insert
     """
     email_clean = email.strip().lower()
 
-    # Return existing entry early (idempotent)
-    existing = await get_waitlist_entry(email_clean)
-    if existing:
-        position = await get_waitlist_position(email_clean)
-        return {
-            "is_new": False,
-            "referral_code": existing.get("referral_code") or "",
-            "position": position,
-            "referral_count": existing.get("referral_count") or 0,
-        }
-
-    referral_code = _generate_referral_code()
-    now = time.time()
-
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         # Validate the referrer code and get their row id
         referrer_id: int | None = None
         if referred_by_code:
-            cursor = await db.execute(
-                "SELECT id FROM waitlist WHERE referral_code = ? COLLATE NOCASE",
-                (referred_by_code,),
-            )
+            cursor = await db.execute(_WAITLIST_REFERRER_SQL, (referred_by_code,))
             row = await cursor.fetchone()
             if row:
                 referrer_id = row[0]
 
-        try:
-            await db.execute(
-                "INSERT INTO waitlist (email, referral_code, referred_by, created_at) VALUES (?, ?, ?, ?)",
-                (email_clean, referral_code, referred_by_code if referrer_id else None, now),
-            )
-        except aiosqlite.IntegrityError:
-            # Rare race condition — fall back to existing entry
-            await db.commit()
-            existing = await get_waitlist_entry(email_clean)
-            if existing:
-                position = await get_waitlist_position(email_clean)
-                return {
-                    "is_new": False,
-                    "referral_code": existing.get("referral_code") or "",
-                    "position": position,
-                    "referral_count": existing.get("referral_count") or 0,
-                }
-            return {"is_new": False, "referral_code": "", "position": 0, "referral_count": 0}
-
-        # Credit the referrer
-        if referrer_id:
+        # Idempotent: an existing email returns no row and is read back below.
+        async with db.execute(
+            "INSERT INTO waitlist (email, referral_code, referred_by, created_at) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(email) DO NOTHING "
+            "RETURNING referral_code, referral_count",
+            (
+                email_clean,
+                _generate_referral_code(),
+                referred_by_code if referrer_id else None,
+                time.time(),
+            ),
+        ) as cursor:
+            entry = await cursor.fetchone()
+        is_new = entry is not None
+
+        if is_new and referrer_id:
+            # Credit the referrer
             await db.execute(
                 "UPDATE waitlist SET referral_count = referral_count + 1 WHERE id = ?",
                 (referrer_id,),
             )
+        elif not is_new:
+            cursor = await db.execute(
+                "SELECT referral_code, referral_count FROM waitlist WHERE email = ? COLLATE NOCASE",
+                (email_clean,),
+            )
+            entry = await cursor.fetchone()
 
-        await db.commit()
+        cursor = await db.execute(_WAITLIST_POSITION_SQL, (email_clean,))
+        row = await cursor.fetchone()
+        position = row[0] if row else 0
+        cursor = await db.execute(_WAITLIST_COUNT_SQL)
+        row = await cursor.fetchone()
+        total = row[0] if row else 0
 
-    position = await get_waitlist_position(email_clean)
-    return {"is_new": True, "referral_code": referral_code, "position": position, "referral_count": 0}
+    return {
+        "is_new": is_new,
+        "referral_code": (entry["referral_code"] if entry else None) or "",
+        "position": position,
+        "referral_count": (entry["referral_count"] if entry else None) or 0,
+        "total": total,
+    }
 
 
 async def get_waitlist_count() -> int:
-    async with aiosqlite.connect(str(_db_path)) as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM waitlist")
+    """Return the trigger-maintained waitlist size (no table scan)."""
+    async with _read() as db:
+        cursor = await db.execute(_WAITLIST_COUNT_SQL)
         row = await cursor.fetchone()
         return row[0] if row else 0
 
 
+async def get_waitlist_leaderboard(limit: int = 10) -> list[dict]:
+    """Return the top entries by referrals, in queue order, with their position."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT email, referral_count FROM waitlist "
+            "WHERE referral_count > 0 "
+            "ORDER BY referral_count DESC, created_at ASC LIMIT ?",
+            (limit,),
+        )
+        rows = await cursor.fetchall()
+    return [
+        {"position": i, "email": row["email"], "referral_count": row["referral_count"]}
+        for i, row in enumerate(rows, 1)
+    ]
+
+
 # ---------------------------------------------------------------------------
-# Screenplay cache (hash → screenplay JSON, saves OpenAI cost)
+# Screenplay cache (hash → compressed screenplay JSON, saves OpenAI cost)
 # ---------------------------------------------------------------------------
 
 async def get_cached_screenplay(text_hash: str) -> dict | None:
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _read() as db:
         cursor = await db.execute(
-            "SELECT screenplay_json FROM screenplay_cache WHERE text_hash = ?",
+            "SELECT payload FROM screenplay_cache WHERE text_hash = ?",
             (text_hash,),
         )
         row = await cursor.fetchone()
-        return json.loads(row[0]) if row else None
+        return json.loads(zlib.decompress(row[0])) if row else None
 
 
-async def cache_screenplay(text_hash: str, screenplay_json: str) -> None:
-    async with aiosqlite.connect(str(_db_path)) as db:
+async def cache_screenplay(
+    text_hash: str,
+    screenplay_json: str,
+    variant: str | None = None,
+    simhash: str | None = None,
+) -> None:
+    payload = zlib.compress(screenplay_json.encode())
+    now = time.time()
+    async with _write() as db:
         await db.execute(
             "INSERT OR REPLACE INTO screenplay_cache "
-            "(text_hash, screenplay_json, created_at) VALUES (?, ?, ?)",
-            (text_hash, screenplay_json, time.time()),
+            "(text_hash, payload, size_bytes, variant, simhash, created_at, last_accessed_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (text_hash, payload, len(payload), variant, simhash, now, now),
         )
-        await db.commit()
+
+
+async def list_screenplay_fingerprints(created_after: float = 0.0) -> list[tuple[str, str, str]]:
+    """Return (text_hash, variant, simhash) for fingerprinted entries newer than *created_after*."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT text_hash, variant, simhash FROM screenplay_cache "
+            "WHERE simhash IS NOT NULL AND created_at > ?",
+            (created_after,),
+        )
+        return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def touch_cached_screenplays(hits: dict[str, int], accessed_at: float) -> None:
+    """Record batched cache hits (text_hash → hit count) in one transaction."""
+    if not hits:
+        return
+    async with _write() as db:
+        await db.executemany(
+            "UPDATE screenplay_cache SET hit_count = hit_count + ?, last_accessed_at = ? "
+            "WHERE text_hash = ?",
+            [(count, accessed_at, text_hash) for text_hash, count in hits.items()],
+        )
+
+
+async def evict_screenplay_cache(idle_before: float, max_bytes: int) -> list[str]:
+    """Drop entries idle since *idle_before*, then the least recently used ones
+    until the stored payloads fit in *max_bytes*. Returns the evicted hashes."""
+    async with _write() as db:
+        cursor = await db.execute(
+            "DELETE FROM screenplay_cache WHERE last_accessed_at < ? RETURNING text_hash",
+            (idle_before,),
+        )
+        evicted = [row[0] for row in await cursor.fetchall()]
+        cursor = await db.execute(
+            """
+            DELETE FROM screenplay_cache WHERE text_hash IN (
+                SELECT text_hash FROM (
+                    SELECT text_hash,
+                           SUM(size_bytes) OVER (
+                               ORDER BY last_accessed_at DESC, text_hash
+                           ) AS kept_bytes
+                    FROM screenplay_cache
+                ) WHERE kept_bytes > ?
+            ) RETURNING text_hash
+            """,
+            (max_bytes,),
+        )
+        evicted.extend(row[0] for row in await cursor.fetchall())
+    return evicted
+
+
+# ---------------------------------------------------------------------------
+# Render cache (HeyGen payload hash → completed video, saves render time/cost)
+# ---------------------------------------------------------------------------
+
+async def get_cached_render(prompt_hash: str, created_after: float) -> dict | None:
+    """Return the render for *prompt_hash* if it finished after *created_after*."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT video_id, video_url FROM render_cache "
+            "WHERE prompt_hash = ? AND created_at > ?",
+            (prompt_hash, created_after),
+        )
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def cache_render(
+    prompt_hash: str, video_id: str | None, video_url: str, expire_before: float,
+) -> None:
+    """Record a completed render and drop renders older than *expire_before*."""
+    async with _write() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO render_cache (prompt_hash, video_id, video_url, created_at) "
+            "VALUES (?, ?, ?, ?)",
+            (prompt_hash, video_id, video_url, time.time()),
+        )
+        await db.execute("DELETE FROM render_cache WHERE created_at < ?", (expire_before,))
+
+
+# ---------------------------------------------------------------------------
+# Shared state (rate-limit windows and caches seen by every process)
+# ---------------------------------------------------------------------------
+
+async def rate_limit_hit(keys: list[str], now: float, window: float, limit: int) -> bool:
+    """Count one request against every key unless any is at *limit*; True if allowed.
+
+    Sliding-window counter (see ``utils.rate_limit``). The first statement takes
+    the write lock, so concurrent checks from other processes serialize.
+    """
+    window_start = now - now % window
+    overlap = 1 - (now - window_start) / window
+    async with _write() as db:
+        for key in keys:
+            cursor = await db.execute(_ROLL_RATE_LIMIT_SQL, (key, window_start, window))
+            current, previous = await cursor.fetchone()
+            await cursor.close()
+            if previous * overlap + current >= limit:
+                return False
+        placeholders = ", ".join("?" for _ in keys)
+        await db.execute(
+            f"UPDATE rate_limits SET current = current + 1 WHERE key IN ({placeholders})", keys
+        )
+    return True
+
+
+async def sweep_rate_limits(idle_before: float) -> int:
+    """Delete windows with no requests since *idle_before*; returns how many."""
+    async with _write() as db:
+        cursor = await db.execute("DELETE FROM rate_limits WHERE window_start < ?", (idle_before,))
+        return cursor.rowcount
+
+
+async def get_shared_cache(namespace: str, key: str) -> tuple[float, float, str] | None:
+    """(fresh_until, stale_until, JSON value) for a cached key, or None."""
+    async with _read() as db:
+        cursor = await db.execute(
+            "SELECT fresh_until, stale_until, value FROM shared_cache "
+            "WHERE namespace = ? AND key = ?",
+            (namespace, key),
+        )
+        row = await cursor.fetchone()
+        return tuple(row) if row else None  # type: ignore[return-value]
+
+
+async def put_shared_cache(
+    namespace: str, key: str, value: str, fresh_until: float, stale_until: float,
+) -> None:
+    async with _write() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO shared_cache "
+            "(namespace, key, value, fresh_until, stale_until) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, value, fresh_until, stale_until),
+        )
+
+
+async def claim_shared_cache_refresh(namespace: str, key: str, now: float, until: float) -> bool:
+    """Let one process refresh a stale key: True for the caller that claimed it.
+
+    A key that another process already refreshed (fresh again) is not claimed.
+    """
+    async with _write() as db:
+        cursor = await db.execute(
+            "UPDATE shared_cache SET refresh_until = ? "
+            "WHERE namespace = ? AND key = ? AND refresh_until <= ? AND fresh_until <= ?",
+            (until, namespace, key, now, now),
+        )
+        return cursor.rowcount == 1
+
+
+async def delete_shared_cache(namespace: str, key: str) -> None:
+    async with _write() as db:
+        await db.execute(
+            "DELETE FROM shared_cache WHERE namespace = ? AND key = ?", (namespace, key)
+        )
+
+
+async def prune_shared_cache(namespace: str, expired_before: float) -> int:
+    async with _write() as db:
+        cursor = await db.execute(
+            "DELETE FROM shared_cache WHERE namespace = ? AND stale_until < ?",
+            (namespace, expired_before),
+        )
+        return cursor.rowcount
 
 
 # ---------------------------------------------------------------------------
 # Users (linked to Supabase user ID)
 # ---------------------------------------------------------------------------
 
-async def get_user(user_id: str) -> dict | None:
-    async with aiosqlite.connect(str(_db_path)) as db:
-        db.row_factory = aiosqlite.Row
+# Profile reads (/auth/me, Stripe) skip SQLite while fresh; writes through this
+# module drop the entry. Quota checks pass ``fresh=True``: another process (e.g.
+# ``python -m worker`` counting a video) may have written since the entry was cached.
+_user_cache: TTLCache[dict | None] = TTLCache(
+    maxsize=config.USER_CACHE_MAX_ENTRIES, ttl=config.USER_CACHE_TTL_SEC
+)
+
+
+async def _load_user(user_id: str) -> dict | None:
+    async with _read() as db:
         cursor = await db.execute("SELECT * FROM users WHERE id = ?", (user_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
 
 
+async def get_user(user_id: str, fresh: bool = False) -> dict | None:
+    """The user row; *fresh* reads SQLite, bypassing the cache."""
+    if fresh:
+        return await _load_user(user_id)
+    record = await _user_cache.get(user_id, lambda: _load_user(user_id))
+    return dict(record) if record else None
+
+
 async def get_user_by_stripe_customer(customer_id: str) -> dict | None:
-    async with aiosqlite.connect(str(_db_path)) as db:
-        db.row_factory = aiosqlite.Row
-        cursor = await db.execute(
-            "SELECT * FROM users WHERE stripe_customer_id = ?", (customer_id,),
-        )
+    async with _read() as db:
+        cursor = await db.execute(_USER_BY_STRIPE_CUSTOMER_SQL, (customer_id,))
         row = await cursor.fetchone()
         return dict(row) if row else None
 
@@ -385,13 +727,13 @@ async def get_user_by_stripe_customer(customer_id: str) -> dict | None:
 async def create_user(user_id: str, email: str) -> dict:
     now = time.time()
     limit = config.FREE_TIER_VIDEO_LIMIT
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         await db.execute(
             "INSERT OR IGNORE INTO users "
             "(id, email, videos_limit, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
             (user_id, email, limit, now, now),
         )
-        await db.commit()
+    await _user_cache.pop(user_id)
     return (await get_user(user_id))  # type: ignore[return-value]
 
 
@@ -401,16 +743,16 @@ async def update_user(user_id: str, **fields: object) -> None:
     fields["updated_at"] = time.time()
     set_clause = ", ".join(f"{k} = ?" for k in fields)
     values = list(fields.values()) + [user_id]
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         await db.execute(f"UPDATE users SET {set_clause} WHERE id = ?", values)
-        await db.commit()
+    await _user_cache.pop(user_id)
 
 
 async def increment_videos_generated(user_id: str) -> None:
-    async with aiosqlite.connect(str(_db_path)) as db:
+    async with _write() as db:
         await db.execute(
             "UPDATE users SET videos_generated = videos_generated + 1, "
             "updated_at = ? WHERE id = ?",
             (time.time(), user_id),
         )
-        await db.commit()
+    await _user_cache.pop(user_id)
@@ -0,0 +1,339 @@
+"""Numbered schema migrations tracked in ``PRAGMA user_version``.
+
+``MIGRATIONS[i]`` upgrades a database from version ``i`` to ``i + 1``. Each step
+runs in its own ``BEGIN IMMEDIATE`` transaction together with the version bump,
+so a crash never leaves a half-applied step and two processes booting at once
+apply every step exactly once. Append new steps; never edit shipped ones.
+"""
+
+import logging
+import zlib
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+import config
+
+logger = logging.getLogger("strang.migrations")
+
+Migration = Callable[[aiosqlite.Connection], Awaitable[None]]
+
+
+async def _add_missing_columns(
+    db: aiosqlite.Connection, table: str, columns: dict[str, str]
+) -> None:
+    """Add each ``name -> definition`` column that *table* does not have yet."""
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    names = {c[1] for c in await cursor.fetchall()}
+    for name, definition in columns.items():
+        if name not in names:
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+async def _001_baseline(db: aiosqlite.Connection) -> None:
+    """Create the original tables and backfill columns on pre-versioning databases."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id           TEXT PRIMARY KEY,
+            status       TEXT NOT NULL DEFAULT 'pending',
+            engine       TEXT NOT NULL DEFAULT 'heygen',
+            extension_count INTEGER NOT NULL DEFAULT 0,
+            video_id     TEXT,
+            video_url    TEXT,
+            error        TEXT,
+            input_text   TEXT,
+            user_id      TEXT,
+            mode         TEXT NOT NULL DEFAULT 'study',
+            goal         TEXT NOT NULL DEFAULT 'understand',
+            depth        TEXT NOT NULL DEFAULT 'standard',
+            project_title TEXT,
+            key_takeaway TEXT,
+            comprehension_question TEXT,
+            comprehension_answer TEXT,
+            created_at   REAL NOT NULL,
+            updated_at   REAL NOT NULL
+        )
+    """)
+    await _add_missing_columns(db, "jobs", {
+        "engine": "TEXT NOT NULL DEFAULT 'heygen'",
+        "extension_count": "INTEGER NOT NULL DEFAULT 0",
+        "user_id": "TEXT",
+        "mode": "TEXT NOT NULL DEFAULT 'study'",
+        "goal": "TEXT NOT NULL DEFAULT 'understand'",
+        "depth": "TEXT NOT NULL DEFAULT 'standard'",
+        "project_title": "TEXT",
+        "key_takeaway": "TEXT",
+        "comprehension_question": "TEXT",
+        "comprehension_answer": "TEXT",
+    })
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS waitlist (
+            id             INTEGER PRIMARY KEY AUTOINCREMENT,
+            email          TEXT NOT NULL UNIQUE COLLATE NOCASE,
+            referral_code  TEXT UNIQUE,
+            referred_by    TEXT,
+            referral_count INTEGER NOT NULL DEFAULT 0,
+            created_at     REAL NOT NULL
+        )
+    """)
+    await _add_missing_columns(db, "waitlist", {
+        "referral_code": "TEXT",
+        "referred_by": "TEXT",
+        "referral_count": "INTEGER NOT NULL DEFAULT 0",
+    })
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS screenplay_cache (
+            text_hash       TEXT PRIMARY KEY,
+            screenplay_json TEXT NOT NULL,
+            created_at      REAL NOT NULL
+        )
+    """)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id                  TEXT PRIMARY KEY,
+            email               TEXT NOT NULL,
+            stripe_customer_id  TEXT,
+            subscription_status TEXT NOT NULL DEFAULT 'free',
+            subscription_id     TEXT,
+            plan                TEXT NOT NULL DEFAULT 'free',
+            videos_generated    INTEGER NOT NULL DEFAULT 0,
+            videos_limit        INTEGER NOT NULL DEFAULT 1,
+            current_period_start REAL,
+            current_period_end  REAL,
+            created_at          REAL NOT NULL,
+            updated_at          REAL NOT NULL
+        )
+    """)
+    await _add_missing_columns(db, "users", {"current_period_start": "REAL"})
+    # Free is now a one-time trial; bring rows created under older limits in line once.
+    await db.execute(
+        "UPDATE users SET videos_limit = ? WHERE plan = 'free' AND videos_limit != ?",
+        (config.FREE_TIER_VIDEO_LIMIT, config.FREE_TIER_VIDEO_LIMIT),
+    )
+
+
+async def _002_hot_query_indexes(db: aiosqlite.Connection) -> None:
+    """Index the library, Stripe webhook, and referral lookups (see tests/test_query_plans.py)."""
+    # Library view: WHERE user_id = ? ORDER BY created_at DESC walks this backwards.
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_id, created_at)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_users_stripe_customer ON users(stripe_customer_id)"
+    )
+    # The UNIQUE constraint's autoindex uses BINARY collation, so NOCASE lookups can't
+    # use it (and databases that gained the column via ALTER TABLE have no index at all).
+    # Covering for the referrer lookup, which only needs the rowid.
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_waitlist_referral_code_nocase "
+        "ON waitlist(referral_code COLLATE NOCASE)"
+    )
+
+
+async def _003_waitlist_rank_index(db: aiosqlite.Connection) -> None:
+    """Keep waitlist rows in queue order so a rank is two index range counts."""
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_waitlist_rank "
+        "ON waitlist(referral_count DESC, created_at ASC)"
+    )
+
+
+async def _004_waitlist_counter(db: aiosqlite.Connection) -> None:
+    """Maintain the waitlist size in a one-row counter instead of COUNT(*) per request."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS counters (
+            name  TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    await db.execute(
+        "INSERT OR REPLACE INTO counters (name, value) "
+        "SELECT 'waitlist', COUNT(*) FROM waitlist"
+    )
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_waitlist_count_insert AFTER INSERT ON waitlist
+        BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'waitlist';
+        END
+    """)
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_waitlist_count_delete AFTER DELETE ON waitlist
+        BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'waitlist';
+        END
+    """)
+
+
+async def _005_compressed_screenplay_cache(db: aiosqlite.Connection) -> None:
+    """Store screenplays zlib-compressed with size and access stats for eviction."""
+    await db.execute("""
+        CREATE TABLE screenplay_cache_v2 (
+            text_hash        TEXT PRIMARY KEY,
+            payload          BLOB NOT NULL,
+            size_bytes       INTEGER NOT NULL,
+            hit_count        INTEGER NOT NULL DEFAULT 0,
+            created_at       REAL NOT NULL,
+            last_accessed_at REAL NOT NULL
+        )
+    """)
+    cursor = await db.execute(
+        "SELECT text_hash, screenplay_json, created_at FROM screenplay_cache"
+    )
+    for text_hash, screenplay_json, created_at in await cursor.fetchall():
+        payload = zlib.compress(screenplay_json.encode())
+        await db.execute(
+            "INSERT INTO screenplay_cache_v2 "
+            "(text_hash, payload, size_bytes, created_at, last_accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (text_hash, payload, len(payload), created_at, created_at),
+        )
+    await db.execute("DROP TABLE screenplay_cache")
+    await db.execute("ALTER TABLE screenplay_cache_v2 RENAME TO screenplay_cache")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_screenplay_cache_accessed "
+        "ON screenplay_cache(last_accessed_at)"
+    )
+
+
+async def _006_screenplay_fingerprints(db: aiosqlite.Connection) -> None:
+    """Record each entry's mode/goal/depth variant and SimHash for near-duplicate lookup."""
+    await _add_missing_columns(db, "screenplay_cache", {
+        "variant": "TEXT",
+        "simhash": "TEXT",
+    })
+
+
+async def _007_render_cache(db: aiosqlite.Connection) -> None:
+    """Map a HeyGen request payload hash to the finished render it produced."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS render_cache (
+            prompt_hash TEXT PRIMARY KEY,
+            video_id    TEXT,
+            video_url   TEXT NOT NULL,
+            created_at  REAL NOT NULL
+        )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_render_cache_created ON render_cache(created_at)"
+    )
+    await _add_missing_columns(db, "jobs", {"prompt_hash": "TEXT"})
+
+
+async def _008_job_leases(db: aiosqlite.Connection) -> None:
+    """Turn pending jobs into a durable queue claimed through expiring leases."""
+    await _add_missing_columns(db, "jobs", {
+        "lease_owner": "TEXT",
+        "lease_expires_at": "REAL",
+        "attempts": "INTEGER NOT NULL DEFAULT 0",
+    })
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(created_at) WHERE status = 'pending'"
+    )
+
+
+async def _009_status_polling(db: aiosqlite.Connection) -> None:
+    """Track when each processing job's provider status was last checked."""
+    await _add_missing_columns(db, "jobs", {"status_checked_at": "REAL NOT NULL DEFAULT 0"})
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_poll "
+        "ON jobs(status_checked_at) WHERE status = 'processing'"
+    )
+
+
+async def _010_processing_started_at(db: aiosqlite.Connection) -> None:
+    """Record when a job's render started, so the HeyGen timeout excludes queue wait."""
+    await _add_missing_columns(db, "jobs", {"processing_started_at": "REAL"})
+    # Jobs already rendering keep the old behaviour (timed from creation).
+    await db.execute(
+        "UPDATE jobs SET processing_started_at = created_at "
+        "WHERE status = 'processing' AND processing_started_at IS NULL"
+    )
+
+
+async def _011_shared_state(db: aiosqlite.Connection) -> None:
+    """State shared by every process on the box: rate-limit windows and small caches."""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            key          TEXT PRIMARY KEY,
+            window_start REAL NOT NULL,
+            current      INTEGER NOT NULL DEFAULT 0,
+            previous     INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_rate_limits_window ON rate_limits(window_start)"
+    )
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS shared_cache (
+            namespace     TEXT NOT NULL,
+            key           TEXT NOT NULL,
+            value         TEXT NOT NULL,
+            fresh_until   REAL NOT NULL,
+            stale_until   REAL NOT NULL,
+            refresh_until REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (namespace, key)
+        ) WITHOUT ROWID
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_shared_cache_expiry ON shared_cache(namespace, stale_until)"
+    )
+
+
+async def _012_job_claimed_at(db: aiosqlite.Connection) -> None:
+    """Record when a worker claimed each job, so admission can time recent jobs."""
+    await _add_missing_columns(db, "jobs", {"claimed_at": "REAL"})
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_jobs_claimed ON jobs(claimed_at) WHERE claimed_at IS NOT NULL"
+    )
+
+
+MIGRATIONS: list[Migration] = [
+    _001_baseline,
+    _002_hot_query_indexes,
+    _003_waitlist_rank_index,
+    _004_waitlist_counter,
+    _005_compressed_screenplay_cache,
+    _006_screenplay_fingerprints,
+    _007_render_cache,
+    _008_job_leases,
+    _009_status_polling,
+    _010_processing_started_at,
+    _011_shared_state,
+    _012_job_claimed_at,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+async def _user_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def migrate(db: aiosqlite.Connection) -> int:
+    """Apply pending migrations and return the resulting schema version.
+
+    An up-to-date database costs a single ``PRAGMA user_version`` read.
+    """
+    version = await _user_version(db)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version} is newer than this build ({SCHEMA_VERSION})"
+        )
+    while version < SCHEMA_VERSION:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock.
+            version = await _user_version(db)
+            if version < SCHEMA_VERSION:
+                step = MIGRATIONS[version]
+                await step(db)
+                version += 1
+                await db.execute(f"PRAGMA user_version = {version}")
+                logger.info("Applied migration %s (schema version %d)", step.__name__, version)
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return version
@@ -0,0 +1,80 @@
+"""SQLite-backed shared state for processes on one box.
+
+Each uvicorn worker (and ``python -m worker``) otherwise keeps its own rate
+limit counters and status cache, so limits multiply by the worker count and
+HeyGen is asked once per process. These backends keep that state in the app
+database instead; ``SHARED_STATE_BACKEND=memory`` keeps it per process.
+"""
+
+import json
+import time
+from typing import Hashable
+
+import config
+from storage.database import (
+    claim_shared_cache_refresh,
+    delete_shared_cache,
+    get_shared_cache,
+    prune_shared_cache,
+    put_shared_cache,
+    rate_limit_hit,
+    sweep_rate_limits,
+)
+from utils.rate_limit import MemoryBackend, RateLimitBackend
+from utils.ttl_cache import Entry, MemoryStore
+
+
+def shared() -> bool:
+    return config.SHARED_STATE_BACKEND == "sqlite"
+
+
+class SqliteRateLimits:
+    """``utils.rate_limit`` backend counting in the ``rate_limits`` table."""
+
+    async def hit(self, keys: list[str], now: float, length: float, limit: int) -> bool:
+        return await rate_limit_hit(keys, now, length, limit)
+
+    async def sweep(self, idle_before: float) -> None:
+        await sweep_rate_limits(idle_before)
+
+
+class SqliteStore:
+    """``utils.ttl_cache`` store holding JSON values in the ``shared_cache`` table."""
+
+    def __init__(self, namespace: str, prune_every: float = 60.0) -> None:
+        self.namespace = namespace
+        self.prune_every = prune_every
+        self.evictions = 0
+        self._last_prune = 0.0
+
+    async def get(self, key: Hashable) -> Entry | None:
+        row = await get_shared_cache(self.namespace, str(key))
+        if row is None:
+            return None
+        fresh_until, stale_until, value = row
+        return fresh_until, stale_until, json.loads(value)
+
+    async def set(self, key: Hashable, entry: Entry) -> None:
+        fresh_until, stale_until, value = entry
+        await put_shared_cache(self.namespace, str(key), json.dumps(value), fresh_until, stale_until)
+        now = time.time()
+        if now - self._last_prune >= self.prune_every:
+            self._last_prune = now
+            self.evictions += await prune_shared_cache(self.namespace, now)
+
+    async def delete(self, key: Hashable) -> None:
+        await delete_shared_cache(self.namespace, str(key))
+
+    async def claim_refresh(self, key: Hashable, until: float) -> bool:
+        return await claim_shared_cache_refresh(self.namespace, str(key), time.time(), until)
+
+    def size(self) -> int | None:
+        return None  # not tracked; would cost a COUNT(*) per /health
+
+
+def rate_limit_backend() -> RateLimitBackend:
+    return SqliteRateLimits() if shared() else MemoryBackend()
+
+
+def cache_store(namespace: str, maxsize: int) -> SqliteStore | MemoryStore:
+    return SqliteStore(namespace) if shared() else MemoryStore(maxsize)
@@ -1,10 +1,17 @@
 """Pytest fixtures: app with temp SQLite DB and env that disables auth for tests."""
 
 import tempfile
+from collections import OrderedDict
 from pathlib import Path
 
 import pytest
 
+import config
+from services import status_poller
+from utils.rate_limit import MemoryBackend
+from utils.retry_policy import RetryBudget
+from utils.ttl_cache import TTLCache
+
 
 @pytest.fixture(autouse=True)
 def env_and_data_dir(monkeypatch):
@@ -17,8 +24,25 @@ def env_and_data_dir(monkeypatch):
     monkeypatch.setattr("config.SUPABASE_URL", "")
     monkeypatch.setattr("config.STRIPE_SECRET_KEY", "")
     monkeypatch.setattr("config.DB_PATH", db_path)
+    monkeypatch.setattr("config.HTTP_PREWARM", False)
+    # Rate limits and the status cache stay in this process unless a test opts into sqlite;
+    # start every test with a clean slate.
+    monkeypatch.setattr("config.SHARED_STATE_BACKEND", "memory")
+    monkeypatch.setattr("utils.rate_limit._store", {})
+    monkeypatch.setattr("utils.rate_limit._last_sweep", 0.0)
+    monkeypatch.setattr("utils.rate_limit._backend", MemoryBackend())
+    monkeypatch.setattr("utils.auth._verified", OrderedDict())
+    monkeypatch.setattr("utils.auth._signing_keys", {})
+    monkeypatch.setattr("utils.auth._keys_wanted", None)
+    monkeypatch.setattr("utils.circuit_breaker._breakers", {})
+    monkeypatch.setattr("utils.retry_policy._budget", RetryBudget())
+    monkeypatch.setattr("utils.retry_policy._pacers", {})
+    monkeypatch.setattr(status_poller, "_status_cache", status_poller._new_status_cache())
 
     import storage.database as db_module
     monkeypatch.setattr(db_module, "_db_path", db_path)
+    monkeypatch.setattr(db_module, "_user_cache", TTLCache(
+        maxsize=config.USER_CACHE_MAX_ENTRIES, ttl=config.USER_CACHE_TTL_SEC
+    ))
 
     yield tmp
@@ -0,0 +1,80 @@
+"""In-process stand-in for the HeyGen API.
+
+Serves the create and status endpoints through respx, remembers each render
+with the callback it was registered with, and delivers signed completion
+webhooks to the app under test the way HeyGen does.
+"""
+
+import itertools
+import json
+
+import httpx
+import respx
+
+from services.heygen_service import (
+    HEYGEN_STATUS_URL,
+    HEYGEN_VIDEO_AGENT_URL,
+    webhook_signature,
+)
+
+
+class FakeHeyGen:
+    def __init__(self, secret: str) -> None:
+        self.secret = secret
+        self.videos: dict[str, dict] = {}
+        self.status_calls = 0
+        self._ids = itertools.count(1)
+
+    def install(self, router: respx.Router) -> None:
+        router.post(HEYGEN_VIDEO_AGENT_URL).mock(side_effect=self._create)
+        router.get(HEYGEN_STATUS_URL).mock(side_effect=self._status)
+
+    def _create(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        video_id = f"fake-{next(self._ids)}"
+        self.videos[video_id] = {
+            "status": "processing",
+            "video_url": None,
+            "callback_id": body.get("callback_id"),
+            "callback_url": body.get("callback_url"),
+        }
+        return httpx.Response(200, json={"data": {"video_id": video_id}})
+
+    def _status(self, request: httpx.Request) -> httpx.Response:
+        self.status_calls += 1
+        video = self.videos.get(request.url.params.get("video_id", ""))
+        if video is None:
+            return httpx.Response(404, text="video not found")
+        return httpx.Response(200, json={
+            "data": {"status": video["status"], "video_url": video["video_url"]},
+        })
+
+    def finish(self, video_id: str, client, error: str | None = None) -> httpx.Response:
+        """Complete (or fail) a render and POST the signed event to its callback URL."""
+        video = self.videos[video_id]
+        if error:
+            video["status"] = "failed"
+            event = {
+                "event_type": "avatar_video.fail",
+                "event_data": {"video_id": video_id, "msg": error, "callback_id": video["callback_id"]},
+            }
+        else:
+            video["status"] = "completed"
+            video["video_url"] = f"https://cdn.fake-heygen.test/{video_id}.mp4"
+            event = {
+                "event_type": "avatar_video.success",
+                "event_data": {
+                    "video_id": video_id,
+                    "url": video["video_url"],
+                    "callback_id": video["callback_id"],
+                },
+            }
+        body = json.dumps(event).encode()
+        return client.post(
+            httpx.URL(video["callback_url"]).path,
+            content=body,
+            headers={
+                "Content-Type": "application/json",
+                "signature": webhook_signature(body, self.secret),
+            },
+        )
@@ -2,6 +2,9 @@
 
 import json
 import asyncio
+import base64
+import time
+from types import SimpleNamespace
 
 import aiosqlite
 import httpx
@@ -19,6 +22,16 @@ def client():
         yield c
 
 
+def _poll_until_done(client: TestClient, job_id: str, timeout: float = 5.0) -> dict:
+    """Poll status until the job is completed or failed (or *timeout* passes)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        body = client.get(f"/generate/status/{job_id}").json()
+        if body["status"] in ("completed", "failed") or time.monotonic() > deadline:
+            return body
+        time.sleep(0.02)
+
+
 def test_health(client: TestClient):
     r = client.get("/health")
     assert r.status_code == 200
@@ -135,6 +148,73 @@ def test_auth_me_accepts_bearer_when_jwks_mode(client: TestClient, monkeypatch):
     assert r.json()["user_id"] == "user-123"
 
 
+def test_verified_jwt_is_cached_until_exp(client: TestClient, monkeypatch):
+    """A repeat request with the same token skips verification until the token expires."""
+    import jwt as pyjwt
+    import utils.auth as auth_module
+
+    monkeypatch.setattr("config.SUPABASE_JWT_SECRET", "test-secret-with-at-least-32-bytes!")
+    clock = [1_000_000.0]
+    monkeypatch.setattr(auth_module, "time", SimpleNamespace(time=lambda: clock[0]))
+    verified: list[str] = []
+    real_verify = auth_module._verify_supabase_jwt
+
+    def _counting_verify(token: str) -> dict:
+        verified.append(token)
+        return real_verify(token)
+
+    monkeypatch.setattr(auth_module, "_verify_supabase_jwt", _counting_verify)
+    token = pyjwt.encode(
+        {"sub": "user-9", "aud": "authenticated", "exp": int(time.time()) + 3600},
+        "test-secret-with-at-least-32-bytes!",
+        algorithm="HS256",
+    )
+    headers = {"Authorization": f"Bearer {token}"}
+    monkeypatch.setattr("config.AUTH_CACHE_MAX_ENTRIES", 1)
+
+    for _ in range(3):
+        assert client.get("/auth/me", headers=headers).json()["user_id"] == "user-9"
+    assert len(verified) == 1
+    assert list(auth_module._verified) == [auth_module._token_key(token)]  # not the raw token
+
+    # Past exp the cached entry is dropped and the token verified again.
+    clock[0] = time.time() + 7200
+    client.get("/auth/me", headers=headers)
+    assert len(verified) == 2
+
+
+@respx.mock
+def test_jwks_is_prefetched_at_startup_and_verified_without_network(monkeypatch):
+    """Signing keys are loaded in lifespan; verification never fetches, unknown kids wake the refresher."""
+    import jwt as pyjwt
+    import utils.auth as auth_module
+
+    secret = "jwks-test-secret-with-at-least-32-bytes"
+    oct_key = {
+        "kty": "oct",
+        "kid": "key-1",
+        "alg": "HS256",
+        "k": base64.urlsafe_b64encode(secret.encode()).rstrip(b"=").decode(),
+    }
+    monkeypatch.setattr("config.SUPABASE_URL", "https://demo.supabase.co")
+    jwks_route = respx.get("https://demo.supabase.co/auth/v1/.well-known/jwks.json").mock(
+        return_value=httpx.Response(200, json={"keys": [oct_key]})
+    )
+    claims = {"sub": "user-7", "aud": "authenticated", "exp": int(time.time()) + 600}
+    good = pyjwt.encode(claims, secret, algorithm="HS256", headers={"kid": "key-1"})
+    rotated = pyjwt.encode(claims, secret, algorithm="HS256", headers={"kid": "key-2"})
+
+    with TestClient(main_module.app) as client:
+        assert jwks_route.call_count == 1
+        # The symmetric test key stands in for an RS256/ES256 project key.
+        assert auth_module._decode_with_supabase_jwks(good, "HS256")["sub"] == "user-7"
+        with pytest.raises(pyjwt.InvalidTokenError):
+            auth_module._decode_with_supabase_jwks(rotated, "HS256")
+        assert auth_module._keys_wanted.is_set()
+        assert client.get("/health").status_code == 200
+    assert jwks_route.call_count == 1  # nothing fetched on the request path
+
+
 def test_init_db_migrates_jobs_extension_count_column(monkeypatch):
     """Older jobs tables should be migrated to include extension_count."""
     import storage.database as db_module
@@ -295,3 +375,1077 @@ def test_paid_plan_limit_is_enforced(monkeypatch):
         assert "Monthly Pro" in exc.value.detail
 
     asyncio.run(_run())
+
+
+def test_user_record_cache_serves_profile_reads_but_quota_checks_read_sqlite(monkeypatch):
+    """/auth/me reads are cached; writes drop the entry; the quota gate never trusts the cache."""
+    import storage.database as db_module
+
+    user = {"user_id": "cached-user", "email": "c@example.com", "role": "authenticated"}
+    loads: list[str] = []
+    real_load = db_module._load_user
+
+    async def _counting_load(user_id: str) -> dict | None:
+        loads.append(user_id)
+        return await real_load(user_id)
+
+    monkeypatch.setattr(db_module, "_load_user", _counting_load)
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.create_user("cached-user", "c@example.com")
+        await db_module.update_user("cached-user", videos_limit=2)
+        for _ in range(3):
+            await main_module._ensure_user_record(user)
+        assert len(loads) == 2  # create_user's read, then one after update_user dropped it
+
+        # Another process (the standalone worker) counts videos behind this cache.
+        async with aiosqlite.connect(str(db_module._db_path)) as db:
+            await db.execute("UPDATE users SET videos_generated = 2 WHERE id = 'cached-user'")
+            await db.commit()
+        assert (await main_module._ensure_user_record(user))["videos_generated"] == 0  # cached
+        with pytest.raises(HTTPException) as exc:
+            await main_module.require_subscription(None, user)
+        assert exc.value.status_code == 403
+
+        # e.g. the Stripe webhook upgrading the plan
+        await db_module.update_user("cached-user", plan="pro", videos_limit=20)
+        assert (await main_module.require_subscription(None, user))["videos_limit"] == 20
+        assert (await main_module._ensure_user_record(user))["plan"] == "pro"
+
+    asyncio.run(_run())
+
+
+def test_user_cache_drops_a_load_that_raced_a_write(monkeypatch):
+    """A row read before a concurrent write is returned to its caller but not cached."""
+    import storage.database as db_module
+
+    real_load = db_module._load_user
+    gate: dict[str, asyncio.Event] = {}
+
+    async def _slow_load(user_id: str) -> dict | None:
+        row = await real_load(user_id)
+        gate["read"].set()
+        await gate["release"].wait()  # the write lands between the read and the cache fill
+        return row
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.create_user("racy-user", "r@example.com")
+        await db_module._user_cache.pop("racy-user")
+        gate.update(read=asyncio.Event(), release=asyncio.Event())
+        monkeypatch.setattr(db_module, "_load_user", _slow_load)
+
+        reader = asyncio.create_task(db_module.get_user("racy-user"))
+        await gate["read"].wait()
+        await db_module.increment_videos_generated("racy-user")
+        gate["release"].set()
+        assert (await reader)["videos_generated"] == 0  # read before the write
+
+        monkeypatch.setattr(db_module, "_load_user", real_load)
+        assert (await db_module.get_user("racy-user"))["videos_generated"] == 1
+
+    asyncio.run(_run())
+
+
+def test_connection_pool_uses_wal_and_serves_storage_calls(monkeypatch):
+    """Pooled connections run in WAL mode and are reused across storage calls."""
+    import storage.database as db_module
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.open_pool()
+        try:
+            async with db_module._read() as db:
+                cursor = await db.execute("PRAGMA journal_mode")
+                assert (await cursor.fetchone())[0] == "wal"
+                cursor = await db.execute("PRAGMA busy_timeout")
+                assert (await cursor.fetchone())[0] == 5000
+            await db_module.create_job("pooled-job", input_text="text")
+            await db_module.update_job("pooled-job", status="processing")
+            job = await db_module.get_job("pooled-job")
+            assert job["status"] == "processing"
+        finally:
+            await db_module.close_pool()
+        assert db_module._pool is None
+
+    asyncio.run(_run())
+
+
+def test_init_db_records_schema_version_and_skips_applied_migrations(monkeypatch):
+    """A second boot only reads user_version; one-off backfills do not rerun."""
+    import storage.database as db_module
+    from storage.migrations import SCHEMA_VERSION
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.create_user("free-user", "student@example.com")
+        await db_module.update_user("free-user", videos_limit=5)
+
+        await db_module.init_db()
+
+        async with aiosqlite.connect(str(db_module._db_path)) as db:
+            cursor = await db.execute("PRAGMA user_version")
+            assert (await cursor.fetchone())[0] == SCHEMA_VERSION
+        user = await db_module.get_user("free-user")
+        assert user["videos_limit"] == 5
+
+    asyncio.run(_run())
+
+
+def test_waitlist_position_ranks_referrals_then_signup_time(monkeypatch):
+    """Referral credits move an entry ahead of earlier signups."""
+    import storage.database as db_module
+
+    async def _run() -> None:
+        await db_module.init_db()
+        first = await db_module.add_email("first@example.com")
+        await db_module.add_email("second@example.com")
+        third = await db_module.add_email("third@example.com")
+        assert third["position"] == 3
+        assert first["position"] == 1
+
+        await db_module.add_email("friend@example.com", referred_by_code=third["referral_code"])
+        assert await db_module.get_waitlist_position("third@example.com") == 1
+        assert await db_module.get_waitlist_position("FIRST@example.com") == 2
+        assert await db_module.get_waitlist_position("friend@example.com") == 4
+        assert await db_module.get_waitlist_position("missing@example.com") == 0
+
+    asyncio.run(_run())
+
+
+def test_add_email_returns_entry_position_and_total_in_one_call(monkeypatch):
+    """Re-joining is idempotent and never credits the referrer twice."""
+    import storage.database as db_module
+
+    async def _run() -> None:
+        await db_module.init_db()
+        referrer = await db_module.add_email("referrer@example.com")
+        joined = await db_module.add_email("new@example.com", referred_by_code=referrer["referral_code"])
+        assert joined["is_new"] is True
+        assert joined["total"] == 2
+        assert joined["position"] == 2
+
+        again = await db_module.add_email(" NEW@example.com ", referred_by_code=referrer["referral_code"])
+        assert again["is_new"] is False
+        assert again["referral_code"] == joined["referral_code"]
+        assert again["total"] == 2
+
+        entry = await db_module.get_waitlist_entry("referrer@example.com")
+        assert entry["referral_count"] == 1
+
+    asyncio.run(_run())
+
+
+def test_waitlist_count_and_leaderboard_support_etags(client: TestClient):
+    """Polling clients get 304s until the snapshot changes."""
+    client.post("/waitlist", json={"email": "first@example.com"})
+    client.post("/waitlist", json={"email": "second@example.com"})
+
+    r = client.get("/waitlist/count")
+    assert r.status_code == 200
+    assert r.json()["count"] == 2
+    assert "max-age" in r.headers["cache-control"]
+    etag = r.headers["etag"]
+    assert client.get("/waitlist/count", headers={"If-None-Match": etag}).status_code == 304
+
+    client.post("/waitlist", json={"email": "third@example.com"})
+    r2 = client.get("/waitlist/count", headers={"If-None-Match": etag})
+    assert r2.status_code == 200
+    assert r2.json()["count"] == 3
+
+
+def test_waitlist_leaderboard_masks_emails(monkeypatch):
+    import storage.database as db_module
+
+    async def _seed() -> None:
+        await db_module.init_db()
+        referrer = await db_module.add_email("jane.doe@example.com")
+        await db_module.add_email("friend@example.com", referred_by_code=referrer["referral_code"])
+
+    asyncio.run(_seed())
+    with TestClient(main_module.app) as client:
+        r = client.get("/waitlist/leaderboard")
+    assert r.status_code == 200
+    assert r.json()["total"] == 2
+    assert r.json()["entries"] == [
+        {"position": 1, "email": "ja***@example.com", "referral_count": 1},
+    ]
+
+
+def test_waitlist_leaderboard_etag_survives_refreshes_without_changes(monkeypatch):
+    import storage.database as db_module
+    from services import waitlist_snapshot as snapshot_module
+
+    clock = [1000.0]
+    monkeypatch.setattr(snapshot_module, "time", SimpleNamespace(time=lambda: clock[0]))
+    with TestClient(main_module.app) as client:
+        client.post("/waitlist", json={"email": "first@example.com"})
+        client.portal.call(snapshot_module.snapshot.refresh)
+        etag = client.get("/waitlist/leaderboard").headers["etag"]
+
+        clock[0] += 30
+        client.portal.call(snapshot_module.snapshot.refresh)
+        again = client.get("/waitlist/leaderboard", headers={"If-None-Match": etag})
+        assert again.status_code == 304
+
+        client.portal.call(db_module.add_email, "second@example.com")
+        clock[0] += 30
+        client.portal.call(snapshot_module.snapshot.refresh)
+        changed = client.get("/waitlist/leaderboard", headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.json()["total"] == 2
+
+
+def test_screenplay_cache_tiers_hit_counts_and_eviction(monkeypatch):
+    """Memory tier serves repeats; hits are written back; eviction trims the table."""
+    import storage.database as db_module
+    from models.schemas import Screenplay
+    from services.screenplay_cache import ScreenplayCache
+
+    screenplay = Screenplay.model_validate({
+        "project_title": "Cached",
+        "elaborated_content": "Long elaboration. " * 50,
+        "scenes": [{"visual_prompt": "A heart.", "voiceover": "This is a heart."}],
+    })
+
+    async def _run() -> None:
+        await db_module.init_db()
+        writer = ScreenplayCache(max_items=8)
+        await writer.put("hash-a", screenplay, "Passage A", "study:understand:standard")
+        assert (await writer.get("hash-a")) is screenplay
+        assert writer.stats()["memory_hits"] == 1
+
+        reader = ScreenplayCache(max_items=8)
+        assert (await reader.get("hash-a")).project_title == "Cached"
+        assert (await reader.get("missing")) is None
+        assert reader.stats() | {"hit_rate": None} == {
+            "memory_items": 1, "memory_hits": 0, "db_hits": 1, "near_hits": 0, "misses": 1,
+            "hit_rate": None, "near_dup_indexed": None,
+        }
+        await reader.flush_hits()
+        async with aiosqlite.connect(str(db_module._db_path)) as db:
+            cursor = await db.execute(
+                "SELECT hit_count, size_bytes FROM screenplay_cache WHERE text_hash = 'hash-a'"
+            )
+            hit_count, size_bytes = await cursor.fetchone()
+        assert hit_count == 1
+        assert size_bytes < len(screenplay.model_dump_json())
+
+        await writer.put("hash-b", screenplay, "Passage B", "study:understand:standard")
+        monkeypatch.setattr("config.SCREENPLAY_CACHE_MAX_MB", size_bytes * 1.5 / (1024 * 1024))
+        # evict() first writes back the writer's pending memory hit on hash-a,
+        # so the never-read hash-b is the least recently used entry.
+        assert await writer.evict() == ["hash-b"]
+        assert (await ScreenplayCache(max_items=0).get("hash-a")) is not None
+
+    asyncio.run(_run())
+
+
+def test_screenplay_cache_key_ignores_cosmetic_differences():
+    from services.screenplay_cache import screenplay_cache_key
+
+    variant = "study:understand:standard"
+    base = screenplay_cache_key('The heart\'s "septum" separates the ventricles.', variant)
+    assert screenplay_cache_key(
+        "  The heart\u2019s \u201cseptum\u201d   separates\u00a0the ventricles.[12]\n", variant
+    ) == base
+    assert screenplay_cache_key("The heart's \"septum\" separates the ventricles.\u00b9", variant) == base
+    assert screenplay_cache_key('The heart\'s "septum" separates the ventricles.', "study:exam:standard") != base
+
+
+def test_screenplay_cache_key_keeps_brackets_and_superscripts_that_carry_meaning():
+    from services.screenplay_cache import canonicalize_passage, screenplay_cache_key
+
+    variant = "study:understand:standard"
+    assert canonicalize_passage("The ring k[A][B] is graded.") == "The ring k[A][B] is graded."
+    assert canonicalize_passage("Let y = x[1] + 2.") == "Let y = x[1] + 2."
+    assert screenplay_cache_key("The area grows as x²", variant) != screenplay_cache_key(
+        "The area grows as x2", variant
+    )
+    assert canonicalize_passage("It fails.[citation needed] Then[a] it heals,[2][3-5] slowly.") == (
+        "It fails. Then[a] it heals, slowly."
+    )
+
+
+def test_screenplay_cache_serves_near_duplicate_passages(monkeypatch):
+    """A slightly different selection of the same paragraph reuses the cached screenplay."""
+    import storage.database as db_module
+    from models.schemas import Screenplay
+    from services.screenplay_cache import ScreenplayCache, screenplay_cache_key
+
+    passage = (
+        "A ventricular septal defect is a hole in the wall that separates the two lower "
+        "chambers of the heart. Blood flows through the hole from the left side to the right "
+        "side, which makes the heart and lungs work harder than they should. Small defects "
+        "often close on their own during childhood, while larger ones may need surgery."
+    )
+    wider = "In cardiology, " + passage + " Doctors"
+    unrelated = "Photosynthesis converts light energy into chemical energy stored in glucose."
+    variant = "study:understand:standard"
+    screenplay = Screenplay.model_validate({
+        "project_title": "VSD",
+        "scenes": [{"visual_prompt": "A heart.", "voiceover": "This is a heart."}],
+    })
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await ScreenplayCache(8).put(screenplay_cache_key(passage, variant), screenplay, passage, variant)
+
+        cache = ScreenplayCache(8, near_dup_threshold=0.85)
+        await cache.refresh_index()
+        assert (await cache.get(screenplay_cache_key(wider, variant))) is None
+        assert (await cache.get_similar(wider, variant)).project_title == "VSD"
+        assert (await cache.get_similar(wider, "research:methods:advanced")) is None
+        assert (await cache.get_similar(unrelated, variant)) is None
+        stats = cache.stats()
+        # The exact lookup missed and the near-duplicate served it; neither counts twice.
+        assert (stats["misses"], stats["db_hits"], stats["near_hits"], stats["hit_rate"]) == (1, 0, 1, 1.0)
+        assert (await ScreenplayCache(8).get_similar(wider, variant)) is None
+
+    asyncio.run(_run())
+
+
+@respx.mock
+def test_identical_screenplay_reuses_completed_render(monkeypatch):
+    """A second job with the same screenplay completes without a new HeyGen render."""
+    respx.post("https://api.openai.com/v1/chat/completions").mock(
+        return_value=httpx.Response(200, json={
+            "choices": [{"message": {"content": json.dumps({
+                "project_title": "Reuse",
+                "scenes": [{"visual_prompt": "A heart.", "voiceover": "This is a heart."}],
+            })}}]
+        })
+    )
+    create = respx.post("https://api.heygen.com/v1/video_agent/generate").mock(
+        return_value=httpx.Response(200, json={"data": {"video_id": "vid-reuse"}})
+    )
+    respx.get("https://api.heygen.com/v1/video_status.get").mock(
+        return_value=httpx.Response(200, json={
+            "data": {"status": "completed", "video_url": "https://cdn.example/reuse.mp4"},
+        })
+    )
+    monkeypatch.setattr("config.OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+    monkeypatch.setattr("config.STATUS_POLL_INTERVAL_SEC", 0.02)
+
+    with TestClient(main_module.app) as client:
+        first = client.post("/generate", json={"text": "Render reuse passage."}).json()["job_id"]
+        assert _poll_until_done(client, first)["status"] == "completed"
+
+        second = client.post("/generate", json={"text": "Render reuse passage."}).json()["job_id"]
+        status = _poll_until_done(client, second)
+    assert status["status"] == "completed"
+    assert status["video_url"] == "https://cdn.example/reuse.mp4"
+    assert status["title"] == "Reuse"
+    assert create.call_count == 1
+
+
+def test_job_queue_leases_each_job_once_and_resumes_after_restart(monkeypatch):
+    """Pending jobs are claimed once, retried after a lapsed lease, and stale ones fail."""
+    import storage.database as db_module
+    from services.job_queue import JobQueue
+
+    monkeypatch.setattr("config.JOB_STALE_AFTER_SEC", 3600)
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.create_job("job-1", input_text="one")
+
+        first = await db_module.claim_job("worker-a", lease_sec=60)
+        assert first["id"] == "job-1" and first["attempts"] == 1
+        assert await db_module.claim_job("worker-b", lease_sec=60) is None
+        assert await db_module.renew_job_lease("job-1", "worker-b", 60) is False
+
+        # worker-a "crashes": once its lease lapses another worker re-claims the job.
+        await db_module.update_job("job-1", lease_expires_at=time.time() - 1)
+        await db_module.create_job("old-job", input_text="old")
+        await db_module.update_job("old-job", created_at=time.time() - 7200)
+        handled: list[str] = []
+
+        async def handler(job: dict) -> None:
+            await db_module.update_job(job["id"], status="processing")
+            handled.append(job["id"])
+
+        queue = JobQueue(handler, workers=2)
+        await queue.start()
+        for _ in range(200):
+            if handled and queue.active == 0 and await db_module.count_queued_jobs() == 0:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+
+        assert handled == ["job-1"]
+        job = await db_module.get_job("job-1")
+        assert job["attempts"] == 2
+        assert job["lease_owner"] is None
+        assert (await db_module.get_job("old-job"))["status"] == "failed"
+        assert await db_module.count_queued_jobs() == 0
+
+        # Expiry is opt-in: by default an old job is still run.
+        monkeypatch.setattr("config.JOB_STALE_AFTER_SEC", 0)
+        await db_module.create_job("older-job", input_text="older")
+        await db_module.update_job("older-job", created_at=time.time() - 86400)
+        await queue.start()
+        for _ in range(200):
+            if "older-job" in handled and queue.active == 0:
+                break
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        assert handled == ["job-1", "older-job"]
+
+    asyncio.run(_run())
+
+
+def test_standalone_worker_drains_jobs_queued_by_the_api(monkeypatch):
+    """With embedded workers off the API only enqueues; `python -m worker` processes the job."""
+    import worker
+    from storage.database import update_job
+
+    monkeypatch.setattr(main_module.job_queue, "workers", 0)
+    with TestClient(main_module.app) as c:
+        job_id = c.post("/generate", json={"text": "Handled by the worker."}).json()["job_id"]
+        assert c.get("/health").json()["queue"]["workers"] == 0
+        time.sleep(0.1)
+        assert c.get(f"/generate/status/{job_id}").json()["status"] == "pending"
+
+    handled: list[str] = []
+
+    async def handler(job: dict) -> None:
+        await update_job(job["id"], status="processing")
+        handled.append(job["id"])
+
+    monkeypatch.setattr(worker, "run_queued_job", handler)
+
+    async def _run() -> None:
+        stop = asyncio.Event()
+        task = asyncio.create_task(worker.run(stop, workers=2))
+        for _ in range(200):
+            if handled:
+                break
+            await asyncio.sleep(0.01)
+        stop.set()
+        await task
+
+    asyncio.run(_run())
+    assert handled == [job_id]
+
+
+@respx.mock
+def test_status_poller_advances_processing_jobs_once_per_interval(monkeypatch):
+    """The poller completes or times out processing jobs; the endpoint only reads the row."""
+    import storage.database as db_module
+    from services import status_poller
+
+    status = respx.get("https://api.heygen.com/v1/video_status.get").mock(
+        return_value=httpx.Response(200, json={
+            "data": {"status": "completed", "video_url": "https://cdn.example/done.mp4"},
+        })
+    )
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+
+    async def _run() -> None:
+        await db_module.init_db()
+        await db_module.create_job("done", input_text="a")
+        await db_module.update_job("done", status="processing", video_id="vid-done", prompt_hash="ph")
+        await db_module.create_job("stuck", input_text="b")
+        await db_module.update_job(
+            "stuck", status="processing", video_id="vid-stuck", created_at=time.time() - 3600
+        )
+        # Queued for an hour, but its render only just started: not timed out.
+        await db_module.create_job("queued", input_text="c")
+        await db_module.update_job(
+            "queued",
+            status="processing",
+            video_id="vid-queued",
+            created_at=time.time() - 3600,
+            processing_started_at=time.time() - 60,
+        )
+
+        poller = status_poller.StatusPoller()
+        assert await poller.poll_once() == 3
+        assert await poller.poll_once() == 0  # all were checked this interval
+
+        done = await db_module.get_job("done")
+        assert (done["status"], done["video_url"]) == ("completed", "https://cdn.example/done.mp4")
+        assert (await db_module.get_cached_render("ph", 0))["video_id"] == "vid-done"
+        assert (await db_module.get_job("stuck"))["status"] == "failed"
+        assert (await db_module.get_job("queued"))["status"] == "completed"
+
+    asyncio.run(_run())
+    assert status.call_count == 2
+
+
+def test_heygen_webhook_completes_job_without_status_polls(monkeypatch):
+    """Renders register a callback; the signed webhook completes the job, polling is fallback."""
+    from tests.fake_heygen import FakeHeyGen
+
+    fake = FakeHeyGen(secret="whsec-test")
+    monkeypatch.setattr("config.OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+    monkeypatch.setattr("config.HEYGEN_WEBHOOK_URL", "https://api.strang.test/heygen/webhook")
+    monkeypatch.setattr("config.HEYGEN_WEBHOOK_SECRET", fake.secret)
+
+    with respx.mock as router, TestClient(main_module.app) as client:
+        router.post("https://api.openai.com/v1/chat/completions").mock(
+            return_value=httpx.Response(200, json={
+                "choices": [{"message": {"content": json.dumps({
+                    "project_title": "Webhook",
+                    "scenes": [{"visual_prompt": "A heart.", "voiceover": "This is a heart."}],
+                })}}]
+            })
+        )
+        fake.install(router)
+
+        job_id = client.post("/generate", json={"text": "Webhook passage."}).json()["job_id"]
+        deadline = time.monotonic() + 5
+        while client.get(f"/generate/status/{job_id}").json()["title"] is None:
+            assert time.monotonic() < deadline
+            time.sleep(0.02)
+        (video_id, video), = fake.videos.items()
+        assert video["callback_id"] == job_id
+        assert video["callback_url"] == "https://api.strang.test/heygen/webhook"
+
+        forged = client.post(
+            "/heygen/webhook", content=b'{"event_type": "avatar_video.success"}',
+            headers={"signature": "0" * 64},
+        )
+        assert forged.status_code == 400
+
+        assert fake.finish(video_id, client).status_code == 200
+        status = client.get(f"/generate/status/{job_id}").json()
+    assert status["status"] == "completed"
+    assert status["video_url"] == f"https://cdn.fake-heygen.test/{video_id}.mp4"
+    assert fake.status_calls <= 1
+
+
+def test_job_events_stream_pushes_each_transition_until_finished(monkeypatch):
+    """update_job wakes the SSE stream; it emits every state change and ends on completion."""
+    import storage.database as db_module
+
+    monkeypatch.setattr("config.SSE_HEARTBEAT_SEC", 0.05)
+
+    async def _not_disconnected() -> bool:
+        return False
+
+    async def _run() -> list[str]:
+        await db_module.init_db()
+        await db_module.create_job("sse-job", input_text="a")
+        stream = main_module._job_event_stream("sse-job", None, _not_disconnected)
+        chunks = [await anext(stream)]
+
+        async def _advance() -> None:
+            await asyncio.sleep(0.01)
+            await db_module.update_job("sse-job", status="processing", project_title="SSE")
+            await asyncio.sleep(0.08)  # long enough for a keep-alive in between
+            await db_module.update_job("sse-job", status="completed", video_url="https://v/1.mp4")
+
+        advance = asyncio.create_task(_advance())
+        chunks += [chunk async for chunk in stream]
+        await advance
+        return chunks
+
+    chunks = asyncio.run(_run())
+    events = [json.loads(c.split("data: ", 1)[1]) for c in chunks if c.startswith("id: ")]
+    assert [e["status"] for e in events] == ["pending", "processing", "completed"]
+    assert events[-1]["title"] == "SSE" and events[-1]["video_url"] == "https://v/1.mp4"
+    assert ": keep-alive\n\n" in chunks
+
+
+def test_job_events_resume_skips_state_the_client_already_has(client: TestClient):
+    job_id = client.post("/generate", json={"text": "Stream me."}).json()["job_id"]
+    deadline = time.monotonic() + 5
+    while client.get(f"/generate/status/{job_id}").json()["status"] != "failed":
+        assert time.monotonic() < deadline  # no API keys configured, so the job fails
+        time.sleep(0.02)
+
+    r = client.get(f"/generate/events/{job_id}")
+    assert r.headers["content-type"].startswith("text/event-stream")
+    event_id = r.text.split("\n", 1)[0].removeprefix("id: ")
+    assert "event: status" in r.text and '"status":"failed"' in r.text
+
+    resumed = client.get(f"/generate/events/{job_id}", headers={"Last-Event-ID": event_id})
+    assert resumed.text == ""
+    assert client.get("/generate/events/missing").status_code == 404
+
+
+def test_status_long_poll_returns_as_soon_as_the_job_changes():
+    """?wait holds the request until update_job notifies, not until the timeout."""
+    import storage.database as db_module
+
+    async def _run() -> tuple[str, float]:
+        await db_module.init_db()
+        await db_module.create_job("lp-job", input_text="a")
+
+        async def _finish() -> None:
+            await asyncio.sleep(0.05)
+            await db_module.update_job("lp-job", status="completed", video_url="https://v/lp.mp4")
+
+        finish = asyncio.create_task(_finish())
+        started = time.monotonic()
+        response = await main_module.get_status("lp-job", wait=10, _user={})
+        await finish
+        return response.status, time.monotonic() - started
+
+    status, elapsed = asyncio.run(_run())
+    assert status == "completed"
+    assert elapsed < 1
+
+
+def test_status_long_poll_times_out_with_unchanged_status(monkeypatch):
+    """A job nobody touches is returned unchanged once the (capped) wait runs out."""
+    import storage.database as db_module
+
+    monkeypatch.setattr("config.STATUS_LONG_POLL_MAX_SEC", 0.2)
+    monkeypatch.setattr(main_module.job_queue, "workers", 0)
+    asyncio.run(db_module.init_db())
+    asyncio.run(db_module.create_job("idle-job", input_text="a"))
+    with TestClient(main_module.app) as client:
+        started = time.monotonic()
+        r = client.get("/generate/status/idle-job", params={"wait": 30})
+        elapsed = time.monotonic() - started
+    assert r.json()["status"] == "pending"
+    assert 0.2 <= elapsed < 5
+
+
+def test_concurrent_identical_jobs_share_one_screenplay_and_one_render(monkeypatch):
+    """A burst of jobs for one passage makes a single OpenAI call and a single HeyGen create."""
+    import storage.database as db_module
+    from models.schemas import Scene, Screenplay
+    from services import video_pipeline
+
+    calls = {"openai": 0, "heygen": 0}
+
+    async def fake_get_screenplay(text: str, **_kwargs) -> Screenplay:
+        calls["openai"] += 1
+        await asyncio.sleep(0.05)
+        return Screenplay(project_title="Burst", scenes=[Scene(visual_prompt="A.", voiceover="B.")])
+
+    async def fake_create(_screenplay: Screenplay, callback_id: str | None = None) -> str:
+        calls["heygen"] += 1
+        await asyncio.sleep(0.05)
+        return "vid-burst"
+
+    monkeypatch.setattr(video_pipeline, "get_screenplay", fake_get_screenplay)
+    monkeypatch.setattr(video_pipeline, "heygen_create_video", fake_create)
+
+    async def _run() -> list[dict]:
+        await db_module.init_db()
+        ids = [f"burst-{i}" for i in range(3)]
+        for job_id in ids:
+            await db_module.create_job(job_id, input_text="Class assignment passage.")
+        await asyncio.gather(*(
+            video_pipeline.process_video_job(job_id, "Class assignment passage.") for job_id in ids
+        ))
+        return [await db_module.get_job(job_id) for job_id in ids]
+
+    jobs = asyncio.run(_run())
+    assert calls == {"openai": 1, "heygen": 1}
+    assert {(j["status"], j["video_id"]) for j in jobs} == {("processing", "vid-burst")}
+    assert video_pipeline.screenplay_flights.in_flight() == 0
+
+
+@respx.mock
+def test_provider_clients_are_shared_prewarmed_and_closed_with_the_app(monkeypatch):
+    """Calls reuse one pooled client per provider; configured hosts are warmed at startup."""
+    from services.http_clients import clients as http_clients
+
+    monkeypatch.setattr("config.HTTP_PREWARM", True)
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+    warm = respx.head("https://api.heygen.com").mock(return_value=httpx.Response(404))
+    respx.get("https://api.heygen.com/v1/video_status.get").mock(
+        return_value=httpx.Response(200, json={"data": {"status": "processing"}})
+    )
+
+    seen: list = []
+
+    async def _status_twice() -> None:
+        from services.heygen_service import heygen_get_status
+
+        seen.append(http_clients.get("heygen"))
+        await heygen_get_status("vid-1")
+        await heygen_get_status("vid-2")
+        seen.append(http_clients.get("heygen"))
+
+    with TestClient(main_module.app) as client:
+        client.portal.call(_status_twice)
+        deadline = time.monotonic() + 5
+        while not warm.called:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    assert seen[0] is seen[1]
+    assert seen[0].is_closed
+
+
+def test_provider_clients_from_a_finished_loop_are_closed_not_dropped():
+    from services.http_clients import HttpClients
+
+    clients = HttpClients()
+
+    async def _get() -> httpx.AsyncClient:
+        return clients.get("openai")
+
+    async def _get_and_settle() -> httpx.AsyncClient:
+        client = clients.get("openai")
+        await asyncio.sleep(0)  # let the previous loop's clients close
+        return client
+
+    first = asyncio.run(_get())
+    second = asyncio.run(_get_and_settle())
+    assert first is not second
+    assert first.is_closed and not second.is_closed
+    asyncio.run(clients.close())
+
+
+def test_generate_sheds_load_with_retry_after_before_creating_a_job(monkeypatch):
+    """Past the queue limit /generate answers 503 + Retry-After and queues nothing."""
+    monkeypatch.setattr("config.ADMISSION_MAX_QUEUE_DEPTH", 1)
+    monkeypatch.setattr("config.ADMISSION_WORKERS", 2)
+    monkeypatch.setattr("config.ADMISSION_DEFAULT_SERVICE_SEC", 20)
+    monkeypatch.setattr(main_module.job_queue, "workers", 0)
+
+    with TestClient(main_module.app) as client:
+        assert client.post("/generate", json={"text": "First."}).status_code == 200
+        r = client.post("/generate", json={"text": "Second."})
+        health = client.get("/health").json()
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "10"  # one job over, 20s per job across 2 workers
+    assert health["queue"]["depth"] == 1
+    assert health["admission"]["service_time_sec"] == 20.0
+
+
+def test_admission_estimates_from_recent_jobs_and_leased_workers(monkeypatch):
+    """Service time and worker count come from the jobs table, not this process."""
+    import storage.database as db_module
+    from services.admission import AdmissionController
+
+    monkeypatch.setattr("config.ADMISSION_MAX_QUEUE_DEPTH", 1000)
+    monkeypatch.setattr("config.ADMISSION_MAX_WAIT_SEC", 60)
+    monkeypatch.setattr("config.ADMISSION_SAMPLE_JOBS", 2)
+    monkeypatch.setattr("config.ADMISSION_DEFAULT_SERVICE_SEC", 20)
+
+    async def _run() -> None:
+        await db_module.init_db()
+        controller = AdmissionController()
+        assert (await controller.load())[1:] == (20, 1)
+
+        now = time.time()
+        # Oldest claim falls outside the sample; the other two took 4s and ~12s.
+        await db_module.create_job("old", input_text="x")
+        await db_module.update_job(
+            "old", status="processing", claimed_at=now - 500, processing_started_at=now - 300
+        )
+        await db_module.create_job("rendered", input_text="x")
+        await db_module.update_job(
+            "rendered", status="processing", claimed_at=now - 100, processing_started_at=now - 96
+        )
+        await db_module.create_job("failed", input_text="x")
+        await db_module.update_job("failed", claimed_at=now - 12, status="failed")
+        for i in range(40):
+            await db_module.create_job(f"queued-{i}", input_text="x")
+        for i in range(4):  # running in some worker process
+            await db_module.update_job(f"queued-{i}", lease_owner="w", lease_expires_at=now + 60)
+
+        depth, service_time, workers = await controller.load()
+        assert (depth, workers) == (40, 4)
+        assert service_time == pytest.approx(8, abs=0.5)
+        assert controller.retry_after(depth, 8, workers) == 20  # 80s estimated wait, 20s over
+        monkeypatch.setattr("config.ADMISSION_WORKERS", 8)
+        assert (await controller.load())[2] == 8
+        assert controller.retry_after(depth, 8, 8) == 0
+
+    asyncio.run(_run())
+
+
+def test_circuit_breaker_opens_fails_fast_and_recovers_through_one_probe(monkeypatch):
+    from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+    monkeypatch.setattr("config.BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr("config.BREAKER_RESET_SEC", 30)
+    clock = [1000.0]
+    monkeypatch.setattr("utils.circuit_breaker.time.monotonic", lambda: clock[0])
+    breaker = CircuitBreaker("test")
+
+    async def fail() -> None:
+        raise httpx.ConnectError("down")
+
+    async def ok() -> str:
+        return "ok"
+
+    async def _run() -> None:
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await breaker.call(fail)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)
+
+        clock[0] += 31
+        breaker.before_call()  # the single half-open probe slot
+        assert breaker.state == HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(ok)  # a second concurrent probe is refused
+        breaker.record_failure()
+        assert breaker.state == OPEN
+
+        clock[0] += 31
+        assert await breaker.call(ok) == "ok"
+        assert breaker.state == CLOSED
+
+    asyncio.run(_run())
+
+
+@respx.mock
+def test_open_heygen_breaker_fast_fails_renders_and_pauses_status_checks(monkeypatch):
+    """5xx from HeyGen opens its breaker: creates fail without a call, polled jobs stay put."""
+    import storage.database as db_module
+    from models.schemas import Scene, Screenplay
+    from services import status_poller
+    from services.heygen_service import heygen_create_video
+
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+    monkeypatch.setattr("config.BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr("config.RETRY_MAX_ATTEMPTS", 1)
+    create = respx.post("https://api.heygen.com/v1/video_agent/generate").mock(
+        return_value=httpx.Response(502, text="bad gateway")
+    )
+    status = respx.get("https://api.heygen.com/v1/video_status.get")
+    screenplay = Screenplay(project_title="T", scenes=[Scene(visual_prompt="A.", voiceover="B.")])
+
+    async def _run() -> None:
+        await db_module.init_db()
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await heygen_create_video(screenplay)
+            assert exc.value.status_code == 502
+        with pytest.raises(HTTPException) as exc:
+            await heygen_create_video(screenplay)
+        assert exc.value.status_code == 503
+
+        await db_module.create_job("polled", input_text="a")
+        await db_module.update_job("polled", status="processing", video_id="vid-p")
+        assert await status_poller.StatusPoller().poll_once() == 1
+        assert (await db_module.get_job("polled"))["status"] == "processing"
+
+    asyncio.run(_run())
+    assert create.call_count == 2
+    assert status.call_count == 0
+    with TestClient(main_module.app) as client:
+        assert client.get("/health").json()["circuit_breakers"]["heygen"]["state"] == "open"
+
+
+@respx.mock
+def test_provider_429_is_retried_after_retry_after_within_the_retry_budget(monkeypatch):
+    """429/5xx are retried as the provider asks; the shared budget caps retries; quota paces calls."""
+    from services.openai_director import get_screenplay
+    from utils import retry_policy
+
+    monkeypatch.setattr("config.OPENAI_API_KEY", "sk-test")
+    monkeypatch.setattr("config.RETRY_BASE_DELAY_SEC", 0)
+    screenplay = {"choices": [{"message": {"content": json.dumps({
+        "project_title": "Paced",
+        "scenes": [{"visual_prompt": "A.", "voiceover": "B."}],
+    })}}]}
+    route = respx.post("https://api.openai.com/v1/chat/completions").mock(side_effect=[
+        httpx.Response(429, headers={"Retry-After": "0"}, json={"error": {"message": "slow down"}}),
+        httpx.Response(
+            200,
+            headers={"x-ratelimit-remaining-requests": "2", "x-ratelimit-reset-requests": "1s"},
+            json=screenplay,
+        ),
+    ])
+
+    assert asyncio.run(get_screenplay("Some passage.")).project_title == "Paced"
+    assert route.call_count == 2
+    assert retry_policy.retry_stats()["retries"] == 1
+    # Two requests left in a 1s window: later calls are spaced half a second apart.
+    assert retry_policy._pacers["openai"].interval == 0.5
+
+    monkeypatch.setattr(retry_policy, "_budget", retry_policy.RetryBudget())
+    retry_policy._budget.tokens = 0
+    retry_policy._pacers.clear()
+    route.side_effect = None
+    route.return_value = httpx.Response(503, json={"error": {"message": "overloaded"}})
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(get_screenplay("Some passage."))
+    assert exc.value.status_code == 502
+    assert route.call_count == 3  # no budget left: the 503 is not retried
+    assert retry_policy.retry_stats()["budget_exhausted"] == 1
+
+
+def test_retry_policy_reads_provider_wait_headers():
+    from utils.retry_policy import _parse_duration, _response_delay
+
+    assert _parse_duration("6m0s") == 360
+    assert _parse_duration("120ms") == pytest.approx(0.12)
+    assert _parse_duration("1.5s") == 1.5
+    limited = httpx.Response(429, headers={"x-ratelimit-reset-requests": "20s"})
+    assert _response_delay(limited, 1) == 20
+    assert _response_delay(httpx.Response(503, headers={"Retry-After": "7"}), 1) == 7
+
+
+def test_pacer_waits_out_the_full_pause_and_picks_up_later_429s(monkeypatch):
+    from utils.retry_policy import Pacer
+
+    monkeypatch.setattr("config.RETRY_MAX_DELAY_SEC", 0.01)  # caps retries, not pacing
+    pacer = Pacer()
+
+    async def scenario() -> float:
+        started = time.monotonic()
+        pacer.resume_at = started + 0.05
+        waiting = asyncio.ensure_future(pacer.wait())
+        await asyncio.sleep(0.02)
+        # Another caller got a 429 meanwhile: the waiter sleeps until the new resume time.
+        pacer.observe(httpx.Response(429, headers={"Retry-After": "0.1"}))
+        await waiting
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) >= 0.12
+
+
+def test_status_cache_is_bounded_and_serves_stale_while_one_call_refreshes(monkeypatch):
+    from utils.ttl_cache import TTLCache
+
+    clock = [100.0]
+    # Replace the module's clock only; the event loop keeps using the real one.
+    monkeypatch.setattr("utils.ttl_cache.time", SimpleNamespace(time=lambda: clock[0]))
+    cache: TTLCache[str] = TTLCache(maxsize=2, ttl=10, stale_ttl=20)
+    calls: list[str] = []
+
+    def fetcher(key: str, value: str):
+        async def fetch() -> str:
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return value
+        return fetch
+
+    async def _run() -> None:
+        # Concurrent misses for one key load it once.
+        assert await asyncio.gather(*(cache.get("a", fetcher("a", "v1")) for _ in range(5))) == ["v1"] * 5
+        assert calls == ["a"]
+
+        clock[0] += 15  # past the TTL, inside the stale window
+        stale = await asyncio.gather(*(cache.get("a", fetcher("a", "v2")) for _ in range(5)))
+        assert stale == ["v1"] * 5  # served immediately...
+        await asyncio.sleep(0.05)
+        assert calls == ["a", "a"]  # ...while exactly one refresh ran
+        assert await cache.get("a", fetcher("a", "v3")) == "v2"
+
+        await cache.get("b", fetcher("b", "b"))
+        await cache.get("c", fetcher("c", "c"))
+        assert cache.stats()["entries"] == 2  # "a" was least recently used and evicted
+
+    asyncio.run(_run())
+    stats = cache.stats()
+    assert (stats["hits"], stats["stale_hits"], stats["misses"], stats["evictions"]) == (1, 5, 7, 1)
+
+
+@respx.mock
+def test_status_cache_keeps_only_status_fields(monkeypatch):
+    import storage.database as db_module
+    from services import status_poller
+
+    monkeypatch.setattr("config.HEYGEN_API_KEY", "hg-test")
+    respx.get("https://api.heygen.com/v1/video_status.get").mock(
+        return_value=httpx.Response(200, json={
+            "data": {"status": "processing", "thumbnail": "x" * 10_000},
+        })
+    )
+
+    async def _run() -> None:
+        await db_module.init_db()
+        assert await status_poller._get_cached_heygen_status("vid") == {"status": "processing"}
+        assert await status_poller._get_cached_heygen_status("vid") == {"status": "processing"}
+
+    asyncio.run(_run())
+    assert respx.calls.call_count == 1
+    with TestClient(main_module.app) as client:
+        health = client.get("/health").json()
+    assert health["status_poller"]["status_cache"]["hit_rate"] == 0.5
+
+
+def test_rate_limit_sliding_window_keys_user_and_ip_and_evicts_idle_clients(monkeypatch):
+    from utils import rate_limit
+
+    clock = [7200.0]  # the start of a window
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(time=lambda: clock[0]))
+    monkeypatch.setattr("config.RATE_LIMIT_REQUESTS", 4)
+    monkeypatch.setattr("config.RATE_LIMIT_WINDOW_SEC", 3600)
+
+    def _check(client_ip: str, user_id: str | None = None) -> None:
+        asyncio.run(rate_limit.rate_limit_check(client_ip, user_id))
+
+    for _ in range(4):
+        _check("1.1.1.1")
+    with pytest.raises(HTTPException) as exc:
+        _check("1.1.1.1")
+    assert exc.value.status_code == 429
+
+    # Halfway into the next window, half of the previous window still counts.
+    clock[0] += 3600 + 1800
+    _check("1.1.1.1")
+    _check("1.1.1.1")
+    with pytest.raises(HTTPException):
+        _check("1.1.1.1")
+
+    # A signed-in user is limited across IPs; shared identities are not.
+    for n in range(4):
+        _check(f"10.0.0.{n}", "user-1")
+    with pytest.raises(HTTPException):
+        _check("10.0.0.99", "user-1")
+    _check("10.0.0.99", "anonymous")
+
+    clock[0] += 3 * 3600
+    _check("2.2.2.2")
+    assert list(rate_limit._store) == ["ip:2.2.2.2"]
+
+
+def test_sqlite_shared_state_is_seen_by_every_process(monkeypatch):
+    """Separate backend instances (as in separate workers) share limits and cached statuses."""
+    import storage.database as db_module
+    from storage.shared_state import SqliteRateLimits, SqliteStore
+    from utils.ttl_cache import TTLCache
+
+    monkeypatch.setattr("config.RATE_LIMIT_REQUESTS", 3)
+    fetches: list[str] = []
+
+    async def fetch() -> dict:
+        fetches.append("vid")
+        return {"status": "processing"}
+
+    async def _run() -> None:
+        await db_module.init_db()
+        workers = [SqliteRateLimits(), SqliteRateLimits()]
+        allowed = [await workers[n % 2].hit(["ip:1.1.1.1"], 7200.0, 3600, 3) for n in range(4)]
+        assert allowed == [True, True, True, False]
+        await workers[0].sweep(7200.0 + 1)
+        assert await workers[1].hit(["ip:1.1.1.1"], 7200.0, 3600, 3)  # swept: counts restart
+
+        first = TTLCache(maxsize=10, ttl=10, stale_ttl=20, store=SqliteStore("status"))
+        second = TTLCache(maxsize=10, ttl=10, stale_ttl=20, store=SqliteStore("status"))
+        assert await first.get("vid", fetch) == {"status": "processing"}
+        assert await second.get("vid", fetch) == {"status": "processing"}
+        assert fetches == ["vid"]
+
+        # Stale in both processes: exactly one of them claims the refresh.
+        fresh_until, stale_until, value = await first._store.get("vid")
+        await first._store.set("vid", (time.time() - 1, stale_until, value))
+        await first.get("vid", fetch)
+        await second.get("vid", fetch)
+        await asyncio.sleep(0.05)
+        assert fetches == ["vid", "vid"]
+
+        await second.pop("vid")
+        assert await first._store.get("vid") is None
+
+    asyncio.run(_run())
+
+
+def test_generate_rate_limit_is_shared_through_sqlite(monkeypatch):
+    monkeypatch.setattr("config.RATE_LIMIT_REQUESTS", 2)
+    monkeypatch.setattr("config.SHARED_STATE_BACKEND", "sqlite")
+    with TestClient(main_module.app) as client:
+        codes = [client.post("/generate", json={"text": "Passage."}).status_code for _ in range(3)]
+    assert codes == [200, 200, 429]
+    from utils import rate_limit
+    assert rate_limit._store == {}  # counted in the rate_limits table, not in this process
@@ -0,0 +1,46 @@
+"""EXPLAIN QUERY PLAN regression tests: hot queries must stay on their indexes."""
+
+import asyncio
+
+import aiosqlite
+import pytest
+
+import storage.database as db_module
+
+
+def _query_plan(sql: str, params: tuple) -> list[str]:
+    async def _run() -> list[str]:
+        await db_module.init_db()
+        async with aiosqlite.connect(str(db_module._db_path)) as db:
+            cursor = await db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[3] for row in await cursor.fetchall()]
+
+    return asyncio.run(_run())
+
+
+@pytest.mark.parametrize(
+    ("sql", "params", "index"),
+    [
+        (db_module._LIST_USER_JOBS_SQL, ("user-a", 20), "idx_jobs_user_created"),
+        (db_module._USER_BY_STRIPE_CUSTOMER_SQL, ("cus_test",), "idx_users_stripe_customer"),
+        (db_module._WAITLIST_REFERRER_SQL, ("ABCD1234",), "idx_waitlist_referral_code_nocase"),
+        (db_module._WAITLIST_POSITION_SQL, ("a@example.com",), "idx_waitlist_rank"),
+        (db_module._CLAIM_STATUS_CHECKS_SQL, (0.0, 0.0, 200), "idx_jobs_status_poll"),
+        (db_module._RECENT_SERVICE_TIME_SQL, (50,), "idx_jobs_claimed"),
+    ],
+)
+def test_hot_query_uses_index(sql: str, params: tuple, index: str):
+    plan = _query_plan(sql, params)
+    assert any(f"INDEX {index}" in step for step in plan), plan
+    assert not any(step.startswith("SCAN") for step in plan), plan
+    assert not any("TEMP B-TREE" in step for step in plan), plan
+
+
+def test_referrer_lookup_is_covered_by_index():
+    plan = _query_plan(db_module._WAITLIST_REFERRER_SQL, ("ABCD1234",))
+    assert any("COVERING INDEX idx_waitlist_referral_code_nocase" in step for step in plan), plan
+
+
+def test_waitlist_position_counts_on_rank_index_without_window_sort():
+    plan = _query_plan(db_module._WAITLIST_POSITION_SQL, ("a@example.com",))
+    assert sum("COVERING INDEX idx_waitlist_rank" in step for step in plan) == 2, plan
@@ -6,8 +6,11 @@ Auth priority:
 3. If neither is configured → allow all requests (dev mode)
 """
 
+import asyncio
+import hashlib
 import logging
-from functools import lru_cache
+import time
+from collections import OrderedDict
 
 import jwt
 from fastapi import HTTPException, Request
@@ -16,25 +19,46 @@ import config
 
 logger = logging.getLogger("strang.auth")
 
+# Verified tokens: sha256(token) -> (exp, user info), least recently used first.
+# A repeat request with the same token skips signature verification until exp.
+_verified: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
 
 def _supabase_auth_configured() -> bool:
     """Return True when Supabase JWT validation is configured."""
     return bool(config.SUPABASE_JWT_SECRET or config.SUPABASE_URL)
 
 
-@lru_cache(maxsize=4)
-def _jwks_client(jwks_url: str) -> jwt.PyJWKClient:
-    """Build/cache a JWK client per Supabase JWKS URL."""
-    return jwt.PyJWKClient(jwks_url)
+# Supabase signing keys by kid, fetched and refreshed off the request path by
+# services.jwks; verification only ever reads this dict.
+_signing_keys: dict[str | None, jwt.PyJWK] = {}
+# Set when a token names a kid we don't have (key rotation), so services.jwks
+# refreshes early instead of waiting for its next interval.
+_keys_wanted: asyncio.Event | None = None
+
+
+def set_signing_keys(keys: dict[str | None, jwt.PyJWK]) -> None:
+    global _signing_keys
+    _signing_keys = keys
+
+
+def watch_unknown_keys() -> asyncio.Event:
+    """Return a fresh event that is set whenever a token's kid is unknown."""
+    global _keys_wanted
+    _keys_wanted = asyncio.Event()
+    return _keys_wanted
 
 
 def _decode_with_supabase_jwks(token: str, alg: str) -> dict:
-    """Verify an asymmetric Supabase JWT via project JWKS endpoint."""
+    """Verify an asymmetric Supabase JWT against the in-memory project JWKS."""
     if not config.SUPABASE_URL:
         raise jwt.InvalidTokenError("SUPABASE_URL is required for asymmetric JWT verification")
-    jwks_url = f"{config.SUPABASE_URL}/auth/v1/.well-known/jwks.json"
-    jwk_client = _jwks_client(jwks_url)
-    signing_key = jwk_client.get_signing_key_from_jwt(token)
+    kid = jwt.get_unverified_header(token).get("kid")
+    signing_key = _signing_keys.get(kid)
+    if signing_key is None:
+        if _keys_wanted is not None:
+            _keys_wanted.set()
+        raise jwt.InvalidTokenError(f"Unknown JWT signing key: {kid}")
     return jwt.decode(
         token,
         signing_key.key,
@@ -67,6 +91,32 @@ def _verify_supabase_jwt(token: str) -> dict:
     raise jwt.InvalidTokenError(f"Unsupported JWT algorithm: {alg or 'unknown'}")
 
 
+def _token_key(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _cached_user(token: str) -> dict | None:
+    key = _token_key(token)
+    cached = _verified.get(key)
+    if cached is None:
+        return None
+    exp, user = cached
+    if exp <= time.time():
+        del _verified[key]
+        return None
+    _verified.move_to_end(key)
+    return dict(user)
+
+
+def _cache_user(token: str, exp: object, user: dict) -> None:
+    """Remember a verified token until its ``exp`` (tokens without one are not cached)."""
+    if not isinstance(exp, (int, float)) or config.AUTH_CACHE_MAX_ENTRIES <= 0:
+        return
+    _verified[_token_key(token)] = (float(exp), dict(user))
+    while len(_verified) > config.AUTH_CACHE_MAX_ENTRIES:
+        _verified.popitem(last=False)
+
+
 def _extract_bearer(request: Request) -> str | None:
     auth = request.headers.get("Authorization", "")
     if auth.startswith("Bearer "):
@@ -98,13 +148,18 @@ async def require_auth(request: Request) -> dict:
 
     # Supabase JWT
     if _supabase_auth_configured() and bearer:
+        cached = _cached_user(bearer)
+        if cached is not None:
+            return cached
         try:
             payload = _verify_supabase_jwt(bearer)
-            return {
+            user = {
                 "user_id": payload["sub"],
                 "email": payload.get("email", ""),
                 "role": payload.get("role", "authenticated"),
             }
+            _cache_user(bearer, payload.get("exp"), user)
+            return user
         except jwt.ExpiredSignatureError:
             raise HTTPException(status_code=401, detail="Token expired. Please log in again.")
         except jwt.InvalidTokenError as exc:
@@ -0,0 +1,99 @@
+"""Per-provider circuit breakers.
+
+After ``BREAKER_FAILURE_THRESHOLD`` consecutive failures a breaker opens and
+calls fail immediately with ``CircuitOpenError`` for ``BREAKER_RESET_SEC``.
+Then it goes half-open: one probe call is let through, and its outcome closes
+the breaker again or re-opens it for another reset period.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, TypeVar
+
+import config
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"{name} circuit is open; retry in {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def before_call(self) -> None:
+        """Raise ``CircuitOpenError`` unless a call may go through now."""
+        if self.state == CLOSED:
+            return
+        if self.state == OPEN:
+            retry_in = self.opened_at + config.BREAKER_RESET_SEC - time.monotonic()
+            if retry_in > 0:
+                raise CircuitOpenError(self.name, retry_in)
+            self.state = HALF_OPEN
+        if self._probing:
+            raise CircuitOpenError(self.name, config.BREAKER_RESET_SEC)
+        self._probing = True
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= config.BREAKER_FAILURE_THRESHOLD:
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        is_failure: Callable[[T], bool] = lambda _result: False,
+    ) -> T:
+        """Run *fn* through the breaker; exceptions and ``is_failure`` results count against it."""
+        self.before_call()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            self._probing = False  # neither outcome; let the next call probe
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        if is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """The process-wide breaker for provider *name*."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name)
+    return breaker
+
+
+def breaker_states() -> dict[str, dict]:
+    return {name: breaker.stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,21 @@
+"""ETag / Cache-Control helpers for small JSON responses that clients poll."""
+
+import hashlib
+import json
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+
+def cached_json(request: Request, content: dict, max_age: int) -> Response:
+    """Return *content* as JSON with a content ETag, or 304 when the client has it."""
+    body = json.dumps(content, separators=(",", ":"), sort_keys=True)
+    etag = f'W/"{hashlib.sha1(body.encode()).hexdigest()[:16]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}, stale-while-revalidate={max_age}",
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in {tag.strip() for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
@@ -0,0 +1,17 @@
+"""Logging setup shared by the API (``main``) and the standalone ``worker``."""
+
+import logging
+import sys
+
+
+def setup_logging() -> None:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(
+        logging.Formatter(
+            "%(asctime)s | %(levelname)-8s | %(name)s | %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+    )
+    root = logging.getLogger("strang")
+    root.setLevel(logging.INFO)
+    root.addHandler(handler)
@@ -0,0 +1,36 @@
+"""In-process "key changed" notifications for long-lived requests.
+
+Subscribers get an ``asyncio.Event`` that is set whenever the key is published;
+they re-read the source of truth themselves, so bursts of updates coalesce and
+a slow subscriber never queues stale payloads. Publishing is synchronous and
+must happen on the event loop (the storage layer does this after each write).
+"""
+
+import asyncio
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class Broadcaster:
+    def __init__(self) -> None:
+        self._subscribers: dict[str, set[asyncio.Event]] = {}
+
+    def publish(self, key: str) -> None:
+        for event in self._subscribers.get(key, ()):
+            event.set()
+
+    @contextmanager
+    def subscribe(self, key: str) -> Iterator[asyncio.Event]:
+        event = asyncio.Event()
+        self._subscribers.setdefault(key, set()).add(event)
+        try:
+            yield event
+        finally:
+            subscribers = self._subscribers.get(key)
+            if subscribers is not None:
+                subscribers.discard(event)
+                if not subscribers:
+                    del self._subscribers[key]
+
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
@@ -1,28 +1,112 @@
-"""In-memory rate limiter.
+"""Rate limiter (sliding-window counter) over a pluggable backend.
 
-Fine for single-process MVP. For production with multiple workers,
-replace with Redis-backed rate limiting (e.g. slowapi + redis, or a
-token-bucket in Redis).
+Each key keeps two counters: requests in the current fixed window and in the
+previous one. The previous count is weighted by how much of it still overlaps
+the sliding window, which approximates a true sliding log in O(1) memory per
+key. Keys idle for two full windows hold no information and are swept.
+
+The default ``MemoryBackend`` counts per process. With several uvicorn
+workers, ``main.lifespan`` installs ``storage.shared_state.SqliteRateLimits``
+(``SHARED_STATE_BACKEND=sqlite``) so every process on the box shares one count.
 """
 
 import time
-from collections import defaultdict
+from typing import Protocol
 
 from fastapi import HTTPException
 
 import config
 
-_store: dict[str, list[float]] = defaultdict(list)
 
+class _Window:
+    __slots__ = ("start", "current", "previous")
+
+    def __init__(self, start: float) -> None:
+        self.start = start
+        self.current = 0
+        self.previous = 0
+
+
+_store: dict[str, _Window] = {}
+_last_sweep = 0.0
+
+
+def _window(key: str, now: float, length: float) -> _Window:
+    """The counters for *key*, rolled forward to the window containing *now*."""
+    start = now - now % length
+    entry = _store.get(key)
+    if entry is None:
+        entry = _store[key] = _Window(start)
+    elif entry.start != start:
+        # One window later the current count becomes the previous one; later still, both reset.
+        entry.previous = entry.current if start - entry.start == length else 0
+        entry.current = 0
+        entry.start = start
+    return entry
+
+
+def _estimate(entry: _Window, now: float, length: float) -> float:
+    overlap = 1 - (now - entry.start) / length
+    return entry.previous * overlap + entry.current
+
+
+class RateLimitBackend(Protocol):
+    async def hit(self, keys: list[str], now: float, length: float, limit: int) -> bool:
+        """Count one request against every key unless any is at *limit*; True if allowed."""
+
+    async def sweep(self, idle_before: float) -> None:
+        """Forget keys whose last window started before *idle_before*."""
+
+
+class MemoryBackend:
+    """Counters in this process only."""
+
+    async def hit(self, keys: list[str], now: float, length: float, limit: int) -> bool:
+        entries = [_window(key, now, length) for key in keys]
+        if any(_estimate(entry, now, length) >= limit for entry in entries):
+            return False
+        for entry in entries:
+            entry.current += 1
+        return True
+
+    async def sweep(self, idle_before: float) -> None:
+        for key in [k for k, entry in _store.items() if entry.start < idle_before]:
+            del _store[key]
+
+
+_backend: RateLimitBackend = MemoryBackend()
+
+
+def use_backend(backend: RateLimitBackend) -> None:
+    """Install the counter backend; called from ``main.lifespan``."""
+    global _backend
+    _backend = backend
+
+
+async def _sweep(now: float, length: float) -> None:
+    """Drop keys with no requests in the last two windows (at most once per window)."""
+    global _last_sweep
+    if now - _last_sweep < length:
+        return
+    _last_sweep = now
+    await _backend.sweep(now - 2 * length)
+
+
+async def rate_limit_check(client_ip: str, user_id: str | None = None) -> None:
+    """Raise 429 if the client IP or the signed-in user exceeded the request window.
 
-def rate_limit_check(client_id: str) -> None:
-    """Raise 429 if *client_id* exceeded the configured request window."""
+    Both keys are counted, so rotating IPs does not reset a user's quota and
+    one IP cannot spread requests across accounts. Shared identities
+    (``anonymous`` / ``admin``) are limited by IP only.
+    """
     now = time.time()
-    window_start = now - config.RATE_LIMIT_WINDOW_SEC
-    _store[client_id] = [t for t in _store[client_id] if t > window_start]
-    if len(_store[client_id]) >= config.RATE_LIMIT_REQUESTS:
+    length = config.RATE_LIMIT_WINDOW_SEC
+    await _sweep(now, length)
+    keys = [f"ip:{client_ip}"]
+    if user_id and user_id not in ("anonymous", "admin"):
+        keys.append(f"user:{user_id}")
+    if not await _backend.hit(keys, now, length, config.RATE_LIMIT_REQUESTS):
         raise HTTPException(
             status_code=429,
             detail=f"Rate limit exceeded. Try again in {config.RATE_LIMIT_WINDOW_SEC // 60} minutes.",
         )
-    _store[client_id].append(now)
@@ -0,0 +1,206 @@
+"""Shared retry policy for outbound provider calls.
+
+``send`` retries transport errors, 429s and 5xx responses up to
+``RETRY_MAX_ATTEMPTS``, waiting as long as the provider asks (``Retry-After``
+or its ``x-ratelimit-reset`` headers) and backing off exponentially otherwise.
+Every retry spends a token from one process-wide budget that only refills as
+first attempts are made, so during an outage retries stay a small fraction of
+traffic instead of multiplying it. The ``x-ratelimit-remaining`` headers also
+pace later calls: once a provider's quota runs low, calls are spread over the
+rest of its window rather than spending it and hitting 429s.
+"""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import httpx
+
+import config
+
+logger = logging.getLogger("strang.retry")
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str | None) -> float | None:
+    """Seconds from ``"20"``, ``"1.5s"``, ``"6m0s"`` or ``"120ms"`` (OpenAI's reset format)."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts:
+            return None
+        return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+    # Some providers send the reset as a Unix timestamp rather than a delta.
+    return seconds - time.time() if seconds > 1e9 else seconds
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    """Seconds from ``Retry-After`` (delta-seconds or an HTTP date)."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _quota(response: httpx.Response) -> tuple[int | None, float | None]:
+    """(requests remaining, seconds until the window resets) from rate-limit headers."""
+    headers = response.headers
+    remaining = headers.get("x-ratelimit-remaining-requests") or headers.get("x-ratelimit-remaining")
+    reset = headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset")
+    try:
+        remaining_count = int(float(remaining)) if remaining is not None else None
+    except ValueError:
+        remaining_count = None
+    return remaining_count, _parse_duration(reset)
+
+
+class RetryBudget:
+    """Token bucket: each first attempt adds ``RETRY_BUDGET_RATIO``, each retry costs 1."""
+
+    def __init__(self) -> None:
+        self.tokens = float(config.RETRY_BUDGET_BURST)
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_attempt(self) -> None:
+        self.tokens = min(float(config.RETRY_BUDGET_BURST), self.tokens + config.RETRY_BUDGET_RATIO)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            self.exhausted += 1
+            return False
+        self.tokens -= 1
+        self.retries += 1
+        return True
+
+
+class Pacer:
+    """Spaces one provider's calls from its remaining-quota headers."""
+
+    def __init__(self) -> None:
+        self.interval = 0.0  # seconds between calls while quota is low
+        self.next_at = 0.0
+        self.resume_at = 0.0  # no calls at all before this (quota spent or 429)
+
+    async def wait(self) -> None:
+        now = time.monotonic()
+        at = max(now, self.next_at)
+        self.next_at = at + self.interval  # reserve the slot before sleeping
+        while True:
+            # A 429 or spent quota seen while sleeping pushes the remaining wait back.
+            delay = max(at, self.resume_at) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    def observe(self, response: httpx.Response) -> None:
+        now = time.monotonic()
+        remaining, reset = _quota(response)
+        if remaining is not None and reset is not None and reset > 0:
+            if remaining <= 0:
+                self.interval = 0.0
+                self.resume_at = max(self.resume_at, now + reset)
+            elif remaining < config.RETRY_PACE_BELOW_REMAINING:
+                self.interval = reset / remaining
+            else:
+                self.interval = 0.0
+        if response.status_code == 429:
+            # Everyone calling this provider waits, not just the caller that got the 429.
+            delay = _retry_after(response)
+            if delay is not None:
+                self.resume_at = max(self.resume_at, now + delay)
+
+
+_budget = RetryBudget()
+_pacers: dict[str, Pacer] = {}
+
+
+def _pacer(provider: str) -> Pacer:
+    pacer = _pacers.get(provider)
+    if pacer is None:
+        pacer = _pacers[provider] = Pacer()
+    return pacer
+
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with jitter: about BASE, 2*BASE, 4*BASE... capped at 5*BASE."""
+    delay = min(config.RETRY_BASE_DELAY_SEC * 2 ** (attempt - 1), config.RETRY_BASE_DELAY_SEC * 5)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _response_delay(response: httpx.Response, attempt: int) -> float:
+    delay = _retry_after(response)
+    if delay is None and response.status_code == 429:
+        delay = _quota(response)[1]
+    return _backoff(attempt) if delay is None else max(0.0, delay)
+
+
+async def send(
+    provider: str,
+    request: Callable[[], Awaitable[httpx.Response]],
+    attempts: int | None = None,
+) -> httpx.Response:
+    """Run *request* with pacing and budgeted retries; returns the last response.
+
+    *attempts* defaults to ``RETRY_MAX_ATTEMPTS``; pass 1 for calls that are
+    repeated on a schedule anyway (they are still paced).
+
+    Non-retryable responses (and retryable ones once attempts, budget or the
+    provider's requested wait run out) are returned for the caller to handle;
+    transport errors are re-raised under the same conditions.
+    """
+    max_attempts = config.RETRY_MAX_ATTEMPTS if attempts is None else attempts
+    pacer = _pacer(provider)
+    _budget.record_attempt()
+    attempt = 1
+    while True:
+        await pacer.wait()
+        try:
+            response = await request()
+        except httpx.TransportError as exc:
+            if attempt >= max_attempts or not _budget.try_spend():
+                raise
+            delay = _backoff(attempt)
+            logger.info("%s call failed (%s); retry %d in %.1fs", provider, exc, attempt, delay)
+        else:
+            pacer.observe(response)
+            if response.status_code not in RETRYABLE_STATUS or attempt >= max_attempts:
+                return response
+            delay = _response_delay(response, attempt)
+            if delay > config.RETRY_MAX_DELAY_SEC:
+                logger.warning("%s asked to retry in %.0fs; giving up", provider, delay)
+                return response
+            if not _budget.try_spend():
+                logger.warning("Retry budget exhausted; not retrying %s %s", provider, response.status_code)
+                return response
+            logger.info("%s returned %s; retry %d in %.1fs", provider, response.status_code, attempt, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def retry_stats() -> dict:
+    return {
+        "budget_tokens": round(_budget.tokens, 2),
+        "retries": _budget.retries,
+        "budget_exhausted": _budget.exhausted,
+        "paced_interval_sec": {name: round(p.interval, 2) for name, p in _pacers.items() if p.interval},
+    }
@@ -0,0 +1,158 @@
+"""TTL cache with stale-while-revalidate over a pluggable entry store.
+
+Entries are fresh for ``ttl`` seconds (jittered, so keys cached together don't
+expire together), then served stale for ``stale_ttl`` more while a single
+background call refreshes them. A miss is loaded once per key no matter how
+many callers are waiting (``SingleFlight``). A ``set`` or ``pop`` while that
+load runs wins: the loaded value is returned to its callers but not stored,
+since it may have been read before the write.
+
+Entries live in a store: ``MemoryStore`` (this process, at most ``maxsize``
+keys, least recently used evicted first) or a shared one such as
+``storage.shared_state.SqliteStore``, which every process on the box reads and
+where only one process refreshes a stale key.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+from utils.singleflight import SingleFlight
+
+T = TypeVar("T")
+
+logger = logging.getLogger("strang.cache")
+
+# (fresh until, stale until, value); wall-clock times so shared stores agree across processes.
+Entry = tuple[float, float, Any]
+
+
+class MemoryStore:
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, Entry] = OrderedDict()  # least recently used first
+        self.evictions = 0
+
+    async def get(self, key: Hashable) -> Entry | None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: Hashable, entry: Entry) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        # Drop expired entries from the cold end, then enforce the size bound.
+        now = time.time()
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest[1] > now and len(self._entries) <= self.maxsize:
+                break
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    async def claim_refresh(self, key: Hashable, until: float) -> bool:
+        return True  # SingleFlight already allows one refresh per key in this process
+
+    def size(self) -> int | None:
+        return len(self._entries)
+
+
+class TTLCache(Generic[T]):
+    def __init__(
+        self,
+        maxsize: int,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        jitter: float = 0.0,
+        store: Any = None,
+    ) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.jitter = jitter
+        self._store = store if store is not None else MemoryStore(maxsize)
+        self._flights: SingleFlight[T] = SingleFlight()
+        self._refreshes: set[asyncio.Task] = set()
+        self._writes: dict[Hashable, int] = {}  # set/pop calls per key while it is loading
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        """Return the cached value for *key*, calling *fetch* when it is missing or expired."""
+        entry = await self._store.get(key)
+        if entry is not None:
+            fresh_until, stale_until, value = entry
+            now = time.time()
+            if now < stale_until:
+                if now < fresh_until:
+                    self.hits += 1
+                else:
+                    self.stale_hits += 1
+                    self._refresh(key, fetch, value)
+                return value
+        self.misses += 1
+        return await self._flights.do(key, lambda: self._load(key, fetch))
+
+    async def set(self, key: Hashable, value: T) -> None:
+        self._wrote(key)
+        await self._put(key, value)
+
+    async def pop(self, key: Hashable) -> None:
+        self._wrote(key)
+        await self._store.delete(key)
+
+    def _wrote(self, key: Hashable) -> None:
+        if key in self._flights:
+            self._writes[key] = self._writes.get(key, 0) + 1
+
+    async def _put(self, key: Hashable, value: T) -> None:
+        now = time.time()
+        fresh_until = now + self.ttl * random.uniform(1 - self.jitter, 1 + self.jitter)
+        await self._store.set(key, (fresh_until, fresh_until + self.stale_ttl, value))
+
+    async def _load(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        writes = self._writes.get(key, 0)
+        try:
+            value = await fetch()
+            if self._writes.get(key, 0) == writes:
+                await self._put(key, value)
+            return value
+        finally:
+            self._writes.pop(key, None)
+
+    async def _revalidate(self, key: Hashable, fetch: Callable[[], Awaitable[T]], stale: T) -> T:
+        # A shared store lets one process refresh; the others keep serving stale meanwhile.
+        if not await self._store.claim_refresh(key, time.time() + self.ttl):
+            return stale
+        return await self._load(key, fetch)
+
+    def _refresh(self, key: Hashable, fetch: Callable[[], Awaitable[T]], stale: T) -> None:
+        if key in self._flights:
+            return
+        task = asyncio.ensure_future(self._flights.do(key, lambda: self._revalidate(key, fetch, stale)))
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshed)
+
+    def _refreshed(self, task: asyncio.Task) -> None:
+        self._refreshes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # The stale value stays until it expires; the next lookup tries again.
+            logger.info("Background cache refresh failed: %s", task.exception())
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": self._store.size(),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+            "evictions": self._store.evictions,
+        }
@@ -0,0 +1,59 @@
+"""
+Standalone job worker: ``python -m worker``.
+
+Runs the same queue workers the API embeds (services.job_queue +
+services.video_pipeline) without serving HTTP, so render throughput scales
+separately from the API. Any number of worker and API processes can share one
+database: each job is claimed through a lease, so exactly one worker owns it.
+Run the API with EMBEDDED_JOB_WORKERS=0 to leave all jobs to these processes.
+"""
+
+import asyncio
+import logging
+import signal
+
+import config
+from services.http_clients import clients as http_clients
+from services.job_queue import JobQueue
+from services.screenplay_cache import screenplay_cache
+from services.video_pipeline import run_queued_job
+from storage.database import close_pool, init_db, open_pool
+from utils.logs import setup_logging
+
+logger = logging.getLogger("strang.worker")
+
+
+async def run(stop: asyncio.Event, workers: int | None = None) -> None:
+    """Drain the job queue until *stop* is set, then release leases and close the pool."""
+    await init_db()
+    await open_pool()
+    await http_clients.open()
+    await screenplay_cache.refresh_index()
+    queue = JobQueue(run_queued_job, config.JOB_WORKERS if workers is None else workers)
+    await queue.start()
+    # Keeps this process's near-duplicate index in step with screenplays cached elsewhere.
+    maintenance = asyncio.create_task(screenplay_cache.run())
+    logger.info("Worker %s started (%d worker(s))", queue.owner, queue.workers)
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Worker %s shutting down", queue.owner)
+        await queue.stop()
+        maintenance.cancel()
+        await asyncio.gather(maintenance, return_exceptions=True)
+        await screenplay_cache.flush_hits()
+        await http_clients.close()
+        await close_pool()
+
+
+async def _main() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await run(stop)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(_main())